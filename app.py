@@ -1,82 +1,426 @@
-import pdfplumber
+import pymupdf
 import pandas as pd
 import streamlit as st
 import json
 import re
 from pathlib import Path
 from openai import OpenAI
-import boto3
-from io import StringIO, BytesIO
-import base64
+import httpx
+from io import BytesIO
+from datetime import datetime, timedelta
+import logging
+import hashlib
+from string import Template
+import threading
+from functools import lru_cache
+from itertools import chain
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+logger = logging.getLogger(__name__)
 
 # carregar chave da API do secrets (Streamlit Cloud)
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+@st.cache_resource
+def get_openai_client():
+    """
+    Cria o cliente OpenAI uma única vez e o reutiliza entre reruns e sessões.
+    O httpx com HTTP/2 mantém a conexão TLS aberta e multiplexa as chamadas paralelas nela.
+    Erros transitórios (429, 5xx, conexão) são repetidos pelo próprio SDK com backoff exponencial e jitter.
+    """
+    http_client = httpx.Client(http2=True, limits=httpx.Limits(max_keepalive_connections=4))
+    return OpenAI(api_key=st.secrets["OPENAI_API_KEY"], http_client=http_client, max_retries=5)
+
+client = get_openai_client()
+
+MODELO_GPT = "gpt-4o-mini"
+# Extrações simples (identificação) podem usar um modelo mais barato que a classificação
+MODELO_EXTRACAO = "gpt-4o-mini"
+# Modelo maior, usado só quando a classificação com MODELO_GPT falha ou não chega a um achado
+MODELO_GPT_ESCALONAMENTO = "gpt-4o"
+
+# Páginas lidas de cada PDF (o texto além disso não caberia no orçamento de tokens)
+MAX_PAGINAS_PDF = 40
+
+# Orçamento de tokens de cada bloco de texto enviado ao GPT
+LIMITE_TOKENS_EXTRATO = 4000
+LIMITE_TOKENS_DEFESA = 8000
+
+# Teto de tokens de saída das extrações simples
+MAX_TOKENS_IDENTIFICACAO = 1000
+# Teto da classificação (achado, números dos argumentos e alegações resumidas)
+MAX_TOKENS_CLASSIFICACAO = 1500
+
+# --------- Cache de respostas do GPT ---------
+class RespostaTruncadaError(Exception):
+    """Resposta do GPT interrompida antes do fim (p.ex. pelo max_tokens). `parcial` guarda o texto recebido."""
+    def __init__(self, finish_reason, parcial):
+        super().__init__(f"resposta do GPT interrompida (finish_reason={finish_reason})")
+        self.parcial = parcial
+
+@st.cache_data(show_spinner=False, max_entries=256, ttl=3600)
+def _consultar_gpt_em_cache(chave, _sistema, _mensagem, modelo, temperature, _response_format, max_tokens):
+    """
+    Chamada real à API. Os textos (`_sistema`, `_mensagem`) não entram no hash do Streamlit; a `chave` já os representa.
+    Antes da API, consulta o cache persistente no B2 (respostas de outras sessões e de reinícios do app).
+    """
+    salva = ler_resposta_gpt_b2(chave)
+    if salva is not None:
+        return salva
+
+    parametros = {}
+    if _response_format:
+        parametros["response_format"] = _response_format
+    if max_tokens:
+        parametros["max_tokens"] = max_tokens
+
+    resp = client.chat.completions.create(
+        model=modelo,
+        messages=[
+            {"role": "system", "content": _sistema},
+            {"role": "user", "content": _mensagem}
+        ],
+        temperature=temperature,
+        **parametros
+    )
+    conteudo = resp.choices[0].message.content
+    # Respostas cortadas (max_tokens, filtro de conteúdo) viram exceção: o st.cache_data não guarda
+    # exceções, então a próxima tentativa chama a API de novo em vez de repetir a resposta incompleta
+    if resp.choices[0].finish_reason != "stop":
+        raise RespostaTruncadaError(resp.choices[0].finish_reason, conteudo)
+    gravar_resposta_gpt_b2(chave, conteudo)
+    return conteudo
+
+# Espaços/tabs repetidos e linhas em branco em excesso, comuns no texto extraído de PDFs
+_ESPACOS_RE = re.compile(r"[ \t\u00a0]+")
+_LINHAS_VAZIAS_RE = re.compile(r"\n{3,}")
+
+def normalizar_espacos(texto):
+    """Colapsa espaços e linhas em branco repetidas: o mesmo documento com outra diagramação gera o mesmo prompt."""
+    texto = _ESPACOS_RE.sub(" ", texto).replace(" \n", "\n").replace("\n ", "\n")
+    return _LINHAS_VAZIAS_RE.sub("\n\n", texto).strip()
+
+def chave_gpt(sistema, mensagem, modelo, temperature, response_format=None):
+    """SHA-256 de tudo o que determina a resposta do GPT (modelo, temperatura, formato e prompt)."""
+    formato = json.dumps(response_format, sort_keys=True) if response_format else ""
+    return hashlib.sha256(f"{modelo}\x1f{temperature}\x1f{formato}\x1f{sistema}\x1f{mensagem}".encode("utf-8")).hexdigest()
+
+def consultar_gpt(sistema, mensagem, modelo=MODELO_GPT, temperature=0, response_format=None, max_tokens=None):
+    """
+    Envia o prompt ao GPT reaproveitando respostas já obtidas para a mesma entrada.
+    A chave é o SHA-256 de (modelo, temperatura, prompt): reenviar os mesmos PDFs
+    ou qualquer rerun do Streamlit devolve a resposta armazenada sem nova chamada.
+    As respostas expiram após 1 hora em memória e após TTL_CACHE_GPT_B2 no cache do B2 (cache_gpt/).
+
+    `sistema` deve ser uma constante do módulo (instruções fixas) e `mensagem` o texto
+    variável do caso. Como as instruções vêm primeiro e são idênticas a cada chamada,
+    a OpenAI reaproveita o prefixo em cache (prompt caching automático).
+
+    `response_format` (opcional) é repassado à API, p.ex. um JSON Schema de Structured Outputs.
+    `max_tokens` (opcional) limita o tamanho da resposta; respostas cortadas levantam RespostaTruncadaError.
+    """
+    # O texto normalizado é o que vai para a API e para a chave do cache
+    mensagem = normalizar_espacos(mensagem)
+    chave = chave_gpt(sistema, mensagem, modelo, temperature, response_format)
+    return _consultar_gpt_em_cache(chave, sistema, mensagem, modelo, temperature, response_format, max_tokens)
+
+# Primeiro objeto JSON da resposta, mesmo que venha entre cercas ```json ou com texto ao redor
+_JSON_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+def ler_json_gpt(saida):
+    """Retorna o dicionário contido na resposta do GPT, ou None se não houver JSON válido."""
+    m = _JSON_RE.search(saida or "")
+    if not m:
+        return None
+    try:
+        dados = json.loads(m.group(0))
+    except json.JSONDecodeError:
+        return None
+    return dados if isinstance(dados, dict) else None
+
+# Respostas em streaming já concluídas, por chave_gpt (as mais antigas saem primeiro)
+MAX_RESPOSTAS_TRANSMITIDAS = 64
+
+@st.cache_resource
+def get_respostas_transmitidas():
+    """Textos completos das respostas transmitidas, compartilhados entre reruns e sessões."""
+    return {}
+
+def transmitir_gpt(sistema, mensagem, modelo=MODELO_GPT, temperature=0):
+    """
+    Versão em streaming de consultar_gpt para textos livres exibidos ao usuário:
+    devolve um gerador com os trechos da resposta, para uso com st.write_stream.
+    Uma resposta já transmitida por completo para a mesma entrada é devolvida de uma vez, sem nova chamada.
+    """
+    respostas = get_respostas_transmitidas()
+    # Mesma normalização de consultar_gpt
+    mensagem = normalizar_espacos(mensagem)
+    chave = chave_gpt(sistema, mensagem, modelo, temperature)
+    if chave in respostas:
+        yield respostas[chave]
+        return
+
+    resp = client.chat.completions.create(
+        model=modelo,
+        messages=[
+            {"role": "system", "content": sistema},
+            {"role": "user", "content": mensagem}
+        ],
+        temperature=temperature,
+        stream=True
+    )
+    trechos = []
+    for chunk in resp:
+        if chunk.choices and chunk.choices[0].delta.content:
+            trechos.append(chunk.choices[0].delta.content)
+            yield trechos[-1]
+
+    # Só respostas completas entram no cache (um stream interrompido não chega aqui)
+    respostas[chave] = "".join(trechos)
+    while len(respostas) > MAX_RESPOSTAS_TRANSMITIDAS:
+        respostas.pop(next(iter(respostas)), None)
+
+# Downloads simultâneos ao ler os feedbacks do B2
+MAX_DOWNLOADS_B2 = 16
+
+@st.cache_resource
+def get_s3_client(endpoint, key_id, application_key):
+    """Cria o cliente B2 (compatível com S3) uma única vez e o reutiliza entre reruns e sessões."""
+    # Importados só aqui: sem B2 configurado, o boto3 (e os modelos de serviço do botocore) nem é carregado
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint,
+        aws_access_key_id=key_id,
+        aws_secret_access_key=application_key,
+        # Repetição com backoff exponencial em falhas transitórias (throttling, 5xx, conexão);
+        # conexões suficientes para os downloads paralelos de download_feedbacks_from_b2
+        config=Config(retries={"max_attempts": 3, "mode": "standard"}, max_pool_connections=MAX_DOWNLOADS_B2)
+    )
 
 # Configurar cliente B2 (compatível com S3) - com tratamento de erro
 try:
     # Verificar se as credenciais B2 existem
     if all(key in st.secrets for key in ["B2_ENDPOINT", "B2_KEY_ID", "B2_APPLICATION_KEY", "B2_BUCKET_NAME"]):
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=st.secrets["B2_ENDPOINT"],
-            aws_access_key_id=st.secrets["B2_KEY_ID"],
-            aws_secret_access_key=st.secrets["B2_APPLICATION_KEY"]
-        )
+        s3_client = get_s3_client(st.secrets["B2_ENDPOINT"], st.secrets["B2_KEY_ID"], st.secrets["B2_APPLICATION_KEY"])
         BUCKET_NAME = st.secrets["B2_BUCKET_NAME"]
-        FEEDBACK_FILE = "feedbacks.csv"
         B2_CONFIGURED = True
     else:
         raise KeyError("B2 secrets não configurados")
 except Exception as e:
     s3_client = None
     BUCKET_NAME = None
-    FEEDBACK_FILE = "feedbacks.csv"
     B2_CONFIGURED = False
 
+# Cada feedback é gravado como um objeto JSON próprio sob este prefixo (append-only)
+FEEDBACK_PREFIX = "feedbacks/"
+# Respostas do GPT já obtidas (uma por chave_gpt), reaproveitadas entre sessões e reinícios
+CACHE_GPT_PREFIX = "cache_gpt/"
+# Validade das respostas salvas em cache_gpt/ (contêm nome, CPF e alegações; as mais antigas são ignoradas)
+TTL_CACHE_GPT_B2 = timedelta(days=7)
+# Prefixo comum a feedbacks.csv e feedbacks/: uma só listagem cobre os dois
+PREFIXO_LISTAGEM_FEEDBACK = "feedbacks"
+# CSV único usado antes dos objetos por registro; ainda é lido para manter o histórico
+FEEDBACK_FILE = "feedbacks.csv"
+COLUNAS_FEEDBACK = ['timestamp', 'codigo', 'nome', 'decisao', 'achado', 'avaliacao', 'comentario', 'corpo_oficio']
+
 # --------- Funções B2 ---------
+@st.cache_data(show_spinner=False, max_entries=2)
+def _ler_csv_legado_b2(etag):
+    """Lê o histórico legado (feedbacks.csv). Em cache pelo ETag: só é baixado de novo se o arquivo mudar."""
+    response = s3_client.get_object(Bucket=BUCKET_NAME, Key=FEEDBACK_FILE)
+    # O pandas lê direto do corpo da resposta (sem decode + StringIO intermediários)
+    return pd.read_csv(response['Body'], encoding='utf-8')
+
+@st.cache_resource
+def get_feedbacks_lidos_b2():
+    """Feedbacks JSON já baixados, por chave. Os objetos nunca são reescritos, então não expiram."""
+    return {}
+
 def download_feedbacks_from_b2():
-    """Baixa o arquivo feedbacks.csv do Backblaze B2 e retorna como DataFrame."""
+    """
+    Retorna todos os feedbacks do Backblaze B2 como DataFrame: o histórico em feedbacks.csv
+    (se existir) mais um objeto JSON por feedback sob FEEDBACK_PREFIX.
+    Uma única listagem (prefixo "feedbacks", que cobre o CSV e a pasta) diz o que mudou:
+    o CSV só é relido se o ETag mudar e só os objetos JSON ainda não vistos são baixados.
+    """
     if not B2_CONFIGURED or s3_client is None:
-        return pd.DataFrame(columns=['timestamp', 'codigo', 'nome', 'decisao', 'achado', 'avaliacao', 'comentario', 'corpo_oficio'])
+        return pd.DataFrame(columns=COLUNAS_FEEDBACK)
 
     try:
-        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=FEEDBACK_FILE)
-        csv_content = response['Body'].read().decode('utf-8')
-        df = pd.read_csv(StringIO(csv_content))
-        return df
-    except s3_client.exceptions.NoSuchKey:
-        # Arquivo ainda não existe no B2, retornar DataFrame vazio
-        return pd.DataFrame(columns=['timestamp', 'codigo', 'nome', 'decisao', 'achado', 'avaliacao', 'comentario', 'corpo_oficio'])
+        partes = []
+        etag_csv = None
+        chaves = []
+        for pagina in s3_client.get_paginator('list_objects_v2').paginate(Bucket=BUCKET_NAME, Prefix=PREFIXO_LISTAGEM_FEEDBACK):
+            for objeto in pagina.get('Contents', []):
+                if objeto['Key'] == FEEDBACK_FILE:
+                    etag_csv = objeto.get('ETag', '')
+                elif objeto['Key'].startswith(FEEDBACK_PREFIX):
+                    chaves.append(objeto['Key'])
+
+        # Histórico legado (CSV único)
+        if etag_csv is not None:
+            partes.append(_ler_csv_legado_b2(etag_csv))
+
+        # Um objeto JSON por feedback; os novos são baixados em paralelo (o tempo é dominado pela latência de cada GET)
+        lidos = get_feedbacks_lidos_b2()
+        novas = [chave for chave in chaves if chave not in lidos]
+
+        def baixar(chave):
+            # Um objeto ilegível não descarta os demais: devolve None e é contado abaixo
+            try:
+                return json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=chave)['Body'].read())
+            except Exception:
+                return None
+
+        if novas:
+            with ThreadPoolExecutor(max_workers=MAX_DOWNLOADS_B2) as executor:
+                baixados = list(executor.map(baixar, novas))
+            falhas = 0
+            for chave, registro in zip(novas, baixados):
+                if registro is None:
+                    falhas += 1
+                else:
+                    lidos[chave] = registro
+            if falhas:
+                st.warning(f"⚠️ {falhas} feedback(s) não puderam ser lidos do B2 e foram ignorados.")
+
+        registros = [lidos[chave] for chave in chaves if chave in lidos]
+        if registros:
+            partes.append(pd.DataFrame(registros))
+
+        if not partes:
+            # Nenhum feedback gravado ainda, retornar DataFrame vazio
+            return pd.DataFrame(columns=COLUNAS_FEEDBACK)
+        df = pd.concat(partes, ignore_index=True).reindex(columns=COLUNAS_FEEDBACK)
+        # Vocabulário pequeno e fixo: categorias (códigos inteiros) em vez de strings
+        return df.astype({'avaliacao': 'category', 'achado': 'category', 'decisao': 'category'})
     except Exception as e:
         st.warning(f"⚠️ Erro ao baixar feedbacks do B2: {e}")
-        return pd.DataFrame(columns=['timestamp', 'codigo', 'nome', 'decisao', 'achado', 'avaliacao', 'comentario', 'corpo_oficio'])
+        return pd.DataFrame(columns=COLUNAS_FEEDBACK)
 
-def upload_feedbacks_to_b2(df):
-    """Faz upload do DataFrame de feedbacks para o Backblaze B2."""
+def ler_resposta_gpt_b2(chave):
+    """
+    Resposta do GPT salva no B2 para a chave (ver chave_gpt), ou None se não existir ou tiver
+    mais de TTL_CACHE_GPT_B2. Falhas no cache nunca interrompem a análise: viram uma consulta
+    normal à API. Como roda dentro de uma função em cache, as falhas vão para o log e não para st.warning
+    (que seria repetido a cada reaproveitamento da resposta).
+    """
     if not B2_CONFIGURED or s3_client is None:
-        st.error("❌ Backblaze B2 não está configurado. Configure os secrets no Streamlit Cloud.")
-        return False
+        return None
+    from botocore.exceptions import ClientError
 
+    chave_objeto = f"{CACHE_GPT_PREFIX}{chave}.json"
     try:
-        csv_buffer = StringIO()
-        df.to_csv(csv_buffer, index=False)
-        csv_bytes = BytesIO(csv_buffer.getvalue().encode('utf-8'))
-
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key=FEEDBACK_FILE,
-            Body=csv_bytes.getvalue(),
-            ContentType='text/csv'
-        )
-        return True
+        corpo = s3_client.get_object(Bucket=BUCKET_NAME, Key=chave_objeto)['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        logger.warning("Erro ao ler %s do B2: %s", chave_objeto, e)
+        return None
     except Exception as e:
-        st.error(f"❌ Erro ao enviar feedbacks para o B2: {e}")
+        logger.warning("Erro ao ler %s do B2: %s", chave_objeto, e)
+        return None
+
+    try:
+        salva = json.loads(corpo)
+        gravado_em = datetime.fromisoformat(salva["gravado_em"])
+        conteudo = salva["conteudo"]
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning("Resposta em cache inválida em %s: %s", chave_objeto, e)
+        return None
+    if datetime.now() - gravado_em > TTL_CACHE_GPT_B2:
+        return None
+    return conteudo
+
+def gravar_resposta_gpt_b2(chave, conteudo):
+    """Salva a resposta no B2 em segundo plano (sem aguardar nem avisar o usuário)."""
+    if not B2_CONFIGURED or s3_client is None:
+        return
+    get_executor_b2().submit(
+        s3_client.put_object,
+        Bucket=BUCKET_NAME,
+        Key=f"{CACHE_GPT_PREFIX}{chave}.json",
+        Body=json.dumps({"conteudo": conteudo, "gravado_em": datetime.now().isoformat()}, ensure_ascii=False).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+def gravar_feedback_b2(feedback):
+    """
+    Grava um feedback no Backblaze B2 como objeto JSON próprio (feedbacks/AAAA-MM-DD/<timestamp>_<codigo>.json).
+    Só o novo registro trafega: o histórico não é baixado nem reenviado. Roda fora da thread
+    do Streamlit (ver enviar_feedback_b2), por isso não chama st.* e propaga as exceções.
+    """
+    momento = feedback['timestamp']
+    chave = f"{FEEDBACK_PREFIX}{momento:%Y-%m-%d}/{momento:%Y%m%dT%H%M%S%f}_{feedback['codigo']}.json"
+
+    s3_client.put_object(
+        Bucket=BUCKET_NAME,
+        Key=chave,
+        Body=json.dumps(feedback, ensure_ascii=False, default=str).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+@st.cache_resource
+def get_executor_b2():
+    """Pool de threads para gravar feedbacks no B2 sem bloquear a interface."""
+    return ThreadPoolExecutor(max_workers=4)
+
+def enviar_feedback_b2(feedback):
+    """
+    Agenda a gravação do feedback em segundo plano e retorna imediatamente (False se o B2 não está configurado).
+    O resultado é conferido nas execuções seguintes por verificar_envios_feedback.
+    """
+    if not B2_CONFIGURED or s3_client is None:
         return False
 
+    envio = get_executor_b2().submit(gravar_feedback_b2, feedback)
+    st.session_state.setdefault('envios_feedback', []).append(envio)
+    return True
+
+def verificar_envios_feedback():
+    """Avisa (st.toast) o resultado dos envios de feedback já concluídos."""
+    pendentes = []
+    for envio in st.session_state.get('envios_feedback', []):
+        if not envio.done():
+            pendentes.append(envio)
+        elif envio.exception() is not None:
+            st.toast(f"❌ Erro ao enviar feedback para o B2: {envio.exception()}")
+        else:
+            st.toast("✅ Feedback registrado no B2.")
+    st.session_state.envios_feedback = pendentes
+
+PROMPT_SISTEMA_INSIGHTS = """
+Você é um especialista em análise de feedbacks para melhorar sistemas de IA.
+
+Analise os feedbacks enviados pelo usuário (corretos e incorretos) e gere insights acionáveis para melhorar o sistema.
+
+### TAREFA
+Gere um relatório com:
+
+1. **Padrões de Sucesso**: O que o sistema está acertando?
+2. **Padrões de Erro**: Quais erros mais comuns? (analise os comentários dos feedbacks incorretos)
+3. **Recomendações**: Como melhorar os prompts/classificações?
+
+Seja específico e acionável. Foque em melhorias concretas.
+"""
+
+def formatar_feedbacks_prompt(df, limite=10, max_comentario=300):
+    """Uma linha compacta por feedback ("- achado | decisão | comentário"), com o comentário cortado em `max_comentario` caracteres."""
+    return "\n".join(
+        f"- {r['achado']} | {r['decisao']} | {'' if pd.isna(r['comentario']) else str(r['comentario'])[:max_comentario]}"
+        for r in df.head(limite).to_dict('records')
+    )
+
 def processar_feedbacks_para_aprendizado():
     """
     Processa feedbacks armazenados no B2 e gera insights de aprendizado.
-    Retorna dicionário com exemplos corretos e padrões de erros.
+    Retorna dicionário com exemplos corretos e padrões de erros; 'insights' é um texto
+    ou, quando há feedbacks, um gerador com a resposta do GPT em streaming.
     """
     try:
         # Baixar feedbacks do B2
@@ -93,59 +437,39 @@ def processar_feedbacks_para_aprendizado():
             }
 
         # Separar feedbacks corretos e incorretos
-        corretos = df_feedbacks[df_feedbacks['avaliacao'] == 'correto']
-        incorretos = df_feedbacks[df_feedbacks['avaliacao'] == 'incorreto']
-
-        # Gerar insights usando GPT
-        prompt_insights = f"""
-Você é um especialista em análise de feedbacks para melhorar sistemas de IA.
-
-Analise os feedbacks abaixo e gere insights acionáveis para melhorar o sistema:
-
-### FEEDBACKS CORRETOS ({len(corretos)} casos)
-{corretos[['achado', 'decisao', 'comentario']].head(10).to_string() if len(corretos) > 0 else "Nenhum feedback correto ainda"}
-
-### FEEDBACKS INCORRETOS ({len(incorretos)} casos)
-{incorretos[['achado', 'decisao', 'comentario']].head(10).to_string() if len(incorretos) > 0 else "Nenhum feedback incorreto ainda"}
-
-### TAREFA
-Gere um relatório com:
-
-1. **Padrões de Sucesso**: O que o sistema está acertando?
-2. **Padrões de Erro**: Quais erros mais comuns? (analise os comentários dos feedbacks incorretos)
-3. **Recomendações**: Como melhorar os prompts/classificações?
-
-Seja específico e acionável. Foque em melhorias concretas.
-"""
-
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt_insights}],
-            temperature=0.3
+        # Uma única partição por avaliação separa os dois grupos
+        grupos = dict(tuple(df_feedbacks.groupby('avaliacao', observed=True)))
+        corretos = grupos.get('correto', df_feedbacks.iloc[:0])
+        incorretos = grupos.get('incorreto', df_feedbacks.iloc[:0])
+
+        # Gerar insights usando GPT (instruções fixas no system, feedbacks na mensagem)
+        # Uma linha por feedback (achado | decisão | comentário): prompt curto e de tamanho limitado
+        mensagem = (
+            f"### FEEDBACKS CORRETOS ({len(corretos)} casos)\n"
+            f"{formatar_feedbacks_prompt(corretos) if len(corretos) > 0 else 'Nenhum feedback correto ainda'}\n\n"
+            f"### FEEDBACKS INCORRETOS ({len(incorretos)} casos)\n"
+            f"{formatar_feedbacks_prompt(incorretos) if len(incorretos) > 0 else 'Nenhum feedback incorreto ainda'}"
         )
-
-        insights = resp.choices[0].message.content
+        # Gerador: o relatório é exibido à medida que é gerado. O primeiro trecho é lido aqui,
+        # dentro do try e do spinner, para que falhas da API apareçam como erro do processamento
+        insights = transmitir_gpt(PROMPT_SISTEMA_INSIGHTS, mensagem, temperature=0.3)
+        insights = chain([next(insights, "")], insights)
 
         # Preparar exemplos corretos para few-shot learning
-        exemplos_corretos = []
-        if len(corretos) > 0:
-            for _, row in corretos.head(5).iterrows():
-                exemplos_corretos.append({
-                    'achado': row['achado'],
-                    'decisao': row['decisao'],
-                    'corpo_oficio': row['corpo_oficio'][:500]  # Primeiros 500 chars
-                })
-
-        # Identificar padrões de erro
-        padroes_erro = []
-        if len(incorretos) > 0:
-            for _, row in incorretos.iterrows():
-                if pd.notna(row['comentario']) and row['comentario'].strip():
-                    padroes_erro.append({
-                        'achado': row['achado'],
-                        'decisao': row['decisao'],
-                        'problema': row['comentario']
-                    })
+        exemplos_corretos = (
+            corretos.head(5)[['achado', 'decisao', 'corpo_oficio']]
+            .assign(corpo_oficio=lambda d: d['corpo_oficio'].astype(str).str[:500])  # Primeiros 500 chars
+            .to_dict('records')
+        )
+
+        # Identificar padrões de erro (incorretos com comentário preenchido)
+        comentarios = incorretos['comentario'].astype('string')
+        com_comentario = comentarios.notna() & comentarios.str.strip().ne('')
+        padroes_erro = (
+            incorretos.loc[com_comentario.fillna(False), ['achado', 'decisao', 'comentario']]
+            .rename(columns={'comentario': 'problema'})
+            .to_dict('records')
+        )
 
         return {
             'total': len(df_feedbacks),
@@ -185,23 +509,138 @@ ARG_MAP = {
     "13": "Citação genérica de MS 34.677/STF (medida cautelar)"
 }
 
+# ARG_MAP em formato de tabela compacta para os prompts (menos tokens que o repr do dicionário)
+ARG_MAP_TEXTO = "\n".join(f"{num}: {descricao}" for num, descricao in ARG_MAP.items())
+
+# rótulos de achado aceitos na classificação do GPT
+ACHADOS_TCU = [
+    "Apenas CadÚnico",
+    "Apenas 1 filho",
+    "Filho + endereço",
+    "Filho + CadÚnico",
+    "Mais de 1 filho",
+    "Endereço em múltiplas bases",
+    "Pensão do INSS como companheira",
+    "Achado não classificado"
+]
+
+# Sugestões de resposta para argumentos não mapeados: (padrão, texto sugerido)
+SUGESTOES_RESPOSTA = [
+    (
+        re.compile(r"boa[- ]f[ée]|seguran[çc]a jur[íi]dica", re.IGNORECASE),
+        "A invocação de boa-fé e segurança jurídica não descaracteriza o achado. "
+        "O TCU entende que a manutenção do benefício depende da ausência de união estável, "
+        "independentemente da confiança legítima ou da boa-fé alegada."
+    ),
+]
+
 # carregar matriz
-matriz = pd.read_csv("matriz_decisao_revisada_final.csv")
+@st.cache_data
+def carregar_regras_matriz():
+    """
+    Lê a matriz de decisão uma única vez e a indexa como dicionário (achado, argumento) -> resultado,
+    para consultas O(1). O DataFrame é descartado após a indexação.
+    """
+    matriz = pd.read_csv("matriz_decisao_revisada_final.csv")
+    return dict(zip(zip(matriz["achado"], matriz["argumento"]), matriz["resultado"]))
+
+# --------- Execução paralela ---------
+def executar_em_paralelo(*tarefas):
+    """
+    Executa tarefas independentes em paralelo e retorna os resultados na mesma ordem.
+    Cada tarefa é uma tupla (funcao, *args). As chamadas ao GPT passam a maior parte
+    do tempo esperando a rede e o PyMuPDF libera o GIL durante a extração, então
+    rodar em threads sobrepõe as latências.
+    """
+    ctx = get_script_run_ctx()
+
+    def executar(tarefa):
+        # Propaga o contexto do Streamlit para a thread (st.error, cache, etc.)
+        add_script_run_ctx(threading.current_thread(), ctx)
+        funcao, *args = tarefa
+        return funcao(*args)
 
-def extrair_texto(pdf_file):
+    with ThreadPoolExecutor(max_workers=len(tarefas)) as executor:
+        return list(executor.map(executar, tarefas))
+
+# --------- Limite de tokens ---------
+@st.cache_resource
+def get_tokenizador():
+    """Carrega o tokenizador do modelo uma única vez (None se o vocabulário não puder ser baixado)."""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(MODELO_GPT)
+    except Exception:
+        return None
+
+def limitar_tokens(texto, limite):
+    """
+    Corta o texto em `limite` tokens, para que PDFs muito longos não inflem o prompt.
+    Mantém só o início: o texto já vem limitado às primeiras MAX_PAGINAS_PDF páginas, e o que
+    sobra no fim de um recurso longo são os documentos anexados, não os pedidos da defesa.
+    """
+    if not texto:
+        return texto
+    tokenizador = get_tokenizador()
+    if tokenizador is None:
+        # Sem tokenizador: aproximação de ~4 caracteres por token
+        return texto[:limite * 4]
+    tokens = tokenizador.encode(texto)
+    if len(tokens) <= limite:
+        return texto
+    return tokenizador.decode(tokens[:limite])
+
+# Termos que marcam os trechos do extrato que descrevem o indício
+PADRAO_TERMOS_INDICIO = re.compile(
+    r"uni[ãa]o est[áa]vel|companheir[oa]|conviv[êe]ncia|filh[oa]s?\b|endere[çc]o|cad[úu]nico|ind[íi]cio",
+    re.IGNORECASE
+)
+
+def recortar_trechos_indicio(texto, raio=1500):
+    """
+    Mantém só as janelas de ±`raio` caracteres em torno dos termos do indício,
+    unindo as que se sobrepõem. Sem nenhum termo, devolve o início do extrato.
+    """
+    posicoes = [m.start() for m in PADRAO_TERMOS_INDICIO.finditer(texto)]
+    if not posicoes:
+        return texto[:4000]
+
+    janelas = []
+    for pos in posicoes:
+        inicio, fim = max(0, pos - raio), pos + raio
+        if janelas and inicio <= janelas[-1][1]:
+            janelas[-1][1] = fim
+        else:
+            janelas.append([inicio, fim])
+    return "\n...\n".join(texto[inicio:fim] for inicio, fim in janelas)
+
+def extrair_texto(pdf_file, max_paginas=MAX_PAGINAS_PDF):
     """
     Extrai texto do PDF. Retorna o texto extraído ou None se falhar.
+    Somente as primeiras `max_paginas` páginas são lidas; anexos longos não atrasam a extração.
     """
-    texto = ""
+    # Templates chegam como caminho; uploads do Streamlit como arquivo em memória
+    if isinstance(pdf_file, (str, Path)):
+        pdf_bytes = Path(pdf_file).read_bytes()
+    else:
+        pdf_bytes = pdf_file.getvalue()
+    return _extrair_texto_em_cache(pdf_bytes, max_paginas)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _extrair_texto_em_cache(pdf_bytes, max_paginas):
+    """Extração propriamente dita, em cache pelo conteúdo do PDF: reruns e reenvios do mesmo arquivo não reprocessam."""
+    paginas = []
     try:
-        with pdfplumber.open(pdf_file) as pdf:
-            for p in pdf.pages:
-                extracted = p.extract_text()
+        documento = pymupdf.open(stream=pdf_bytes, filetype="pdf")
+
+        with documento:
+            for pagina in documento.pages(0, min(documento.page_count, max_paginas)):
+                extracted = pagina.get_text("text").strip()
                 if extracted:
-                    texto += extracted + "\n"
+                    paginas.append(extracted)
 
         # Verifica se conseguiu extrair conteúdo significativo
-        texto_limpo = texto.strip()
+        texto_limpo = "\n".join(paginas).strip()
         if len(texto_limpo) < 50:  # Menos de 50 caracteres é muito pouco
             return None
 
@@ -210,8 +649,9 @@ def extrair_texto(pdf_file):
         st.error(f"⚠️ Erro ao extrair texto do PDF: {str(e)}")
         return None
 
+@lru_cache(maxsize=2)
 def carregar_template_oficio(decisao):
-    """Carrega o template do ofício baseado na decisão (procedente ou improcedente)."""
+    """Carrega o template do ofício baseado na decisão (procedente ou improcedente). Os templates são estáticos: lidos uma vez por processo."""
     template_path = TEMPLATE_PROCEDENTE if decisao == "procedente" else TEMPLATE_IMPROCEDENTE
 
     if not template_path.exists():
@@ -219,8 +659,20 @@ def carregar_template_oficio(decisao):
 
     return extrair_texto(template_path)
 
-def extrair_item_template(decisao):
-    """Extrai apenas o item 13 (procedente) ou item 15 (improcedente) do template."""
+# Padrões (compilados uma vez) para localizar o item 13 no template, em ordem de preferência
+PADROES_ITEM13 = [
+    re.compile(padrao, re.IGNORECASE | re.DOTALL)
+    for padrao in (
+        # "13." / "13)" / "Item 13:" no início da linha, até o item 14 ou o fecho, numa única varredura
+        r'(?:^|\n)\s*(?:13[.\)]|item\s*13[.\):]?)\s*(.+?)(?=\n\s*(?:item\s*)?14[.\)]|\n\s*Respeitosamente|\Z)',
+        # Último recurso: "13." em qualquer posição
+        r'13[.\)]\s*(.+?)(?=14[.\)]|\Z)'
+    )
+]
+
+@lru_cache(maxsize=2)
+def extrair_item_template(decisao, max_len=2000):
+    """Extrai apenas o item 13 (procedente) ou item 15 (improcedente) do template, limitado a `max_len` caracteres."""
     template_completo = carregar_template_oficio(decisao)
 
     if not template_completo:
@@ -228,34 +680,24 @@ def extrair_item_template(decisao):
 
     # Apenas para procedente (item 13)
     if decisao == "procedente":
-        # Procurar pelo item 13
-        import re
-
         # Tentar diferentes padrões para encontrar o item 13
-        padroes = [
-            r'(?:^|\n)\s*13[.\)]\s*(.+?)(?=\n\s*14[.\)]|\n\s*Respeitosamente|\Z)',
-            r'(?:^|\n)\s*item\s*13[.\):]?\s*(.+?)(?=\n\s*(?:item\s*)?14[.\)]|\n\s*Respeitosamente|\Z)',
-            r'13[.\)]\s*(.+?)(?=14[.\)]|\Z)'
-        ]
-
-        for padrao in padroes:
-            match = re.search(padrao, template_completo, re.IGNORECASE | re.DOTALL)
+        for padrao in PADROES_ITEM13:
+            match = padrao.search(template_completo)
             if match:
-                return match.group(1).strip()
+                return match.group(1).strip()[:max_len]
 
         # Se não encontrou, retorna uma parte do meio do documento
-        return template_completo[len(template_completo)//3:len(template_completo)*2//3]
+        inicio = len(template_completo) // 3
+        return template_completo[inicio:min(len(template_completo) * 2 // 3, inicio + max_len)]
 
     # Para improcedente não mexe (já funciona)
     return None
 
 # --------- Extrair dados de identificação do extrato ---------
-def extrair_dados_identificacao(texto_extrato):
-    """Extrai nome, CPF, código e descrição do indício do extrato do TCU."""
-    prompt = f"""
+PROMPT_SISTEMA_IDENTIFICACAO = """
 Você é um sistema de extração de dados estruturados de extratos do TCU.
 
-Analise o texto do extrato abaixo e extraia as seguintes informações da TABELA:
+Analise o texto do extrato enviado pelo usuário e extraia as seguintes informações da TABELA:
 
 1. **Código do Indício**: número que aparece na coluna "Código Indício" (exemplo: 6201799 ou 6202264)
 
@@ -278,18 +720,14 @@ Analise o texto do extrato abaixo e extraia as seguintes informações da TABELA
    - PARE somente quando encontrar a palavra "Critério:"
    - NÃO inclua a fundamentação legal que vem depois de "Critério: A Lei 3373/1958..."
 
-### Texto do Extrato:
-{texto_extrato}
-
-### Formato de saída
-Responda apenas com JSON válido, sem explicações, sem Markdown, no seguinte formato:
+### Exemplo de saída
 
-{{
+{
   "codigo_indicio": "6201799",
   "cpf": "164.853.578-07",
   "nome": "NORMISIA GONCALVES BEZERRA SOBRAL / EITE",
   "descricao_indicio": "Pensionista filha maior solteira com provável união estável ou casamento. Evidências do indício: Pensionista possui filho em comum..."
-}}
+}
 
 **EXEMPLOS DE NOMES CORRETOS:**
 - "TANIA APARECIDA DOS REIS MARQUES"
@@ -311,23 +749,57 @@ Responda apenas com JSON válido, sem explicações, sem Markdown, no seguinte f
 - NÃO inclua a fundamentação legal que aparece após "Critério:"
 - Se não encontrar alguma informação, use null no campo correspondente
 """
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
+
+# Structured Outputs: JSON garantido, sem cercas de Markdown (null quando o campo não é encontrado)
+FORMATO_IDENTIFICACAO = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "identificacao_extrato",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "codigo_indicio": {"type": ["string", "null"]},
+                "cpf": {"type": ["string", "null"]},
+                "nome": {"type": ["string", "null"]},
+                "descricao_indicio": {"type": ["string", "null"]}
+            },
+            "required": ["codigo_indicio", "cpf", "nome", "descricao_indicio"],
+            "additionalProperties": False
+        }
+    }
+}
+
+def montar_mensagem_identificacao(texto_extrato):
+    return f"### Texto do Extrato:\n{limitar_tokens(texto_extrato, LIMITE_TOKENS_EXTRATO)}"
+
+# Dados de identificação já resolvidos (campos ausentes ou nulos com o valor padrão)
+DadosIdentificacao = namedtuple("DadosIdentificacao", "nome cpf codigo descricao")
+
+def resolver_identificacao(dados):
+    """Converte o JSON da identificação em DadosIdentificacao, uma única vez por execução."""
+    return DadosIdentificacao(
+        nome=dados.get("nome") or "Não identificado",
+        cpf=dados.get("cpf") or "Não identificado",
+        codigo=dados.get("codigo_indicio") or "Não identificado",
+        descricao=dados.get("descricao_indicio") or None
+    )
+
+def extrair_dados_identificacao(texto_extrato):
+    """Extrai nome, CPF, código e descrição do indício do extrato do TCU."""
+    mensagem = montar_mensagem_identificacao(texto_extrato)
+    return consultar_gpt(
+        PROMPT_SISTEMA_IDENTIFICACAO, mensagem, modelo=MODELO_EXTRACAO,
+        response_format=FORMATO_IDENTIFICACAO, max_tokens=MAX_TOKENS_IDENTIFICACAO
     )
-    return resp.choices[0].message.content
 
 # --------- GPT para JSON técnico ---------
-def classificar_com_gpt(descricao_indicio, texto_defesa):
-    prompt = f"""
+PROMPT_SISTEMA_CLASSIFICACAO = f"""
 Você é um sistema de apoio jurídico que analisa recursos administrativos de pensão de filha maior solteira.
 
-### Bloco 1 — Achado do TCU (descrição do indício)
-{descricao_indicio}
-
-### Bloco 2 — Defesa apresentada pela interessada
-{texto_defesa}
+Você receberá, na mensagem do usuário, dois blocos:
+- Bloco 1 — Achado do TCU (descrição do indício)
+- Bloco 2 — Defesa apresentada pela interessada
 
 ### Tarefa
 1. Classifique o achado do TCU com base APENAS nas evidências específicas mencionadas no Bloco 1:
@@ -355,7 +827,7 @@ Escolha um dos seguintes rótulos:
 - Se a requerente apresentou 20 alegações, você DEVE listar todas as 20
 - Cada alegação distinta deve ser identificada e classificada
 - A quantidade de argumentos NÃO tem limite - liste quantos forem necessários
-{ARG_MAP}
+{ARG_MAP_TEXTO}
 
 ⚠️ IMPORTANTE - Diferenciar CONFISSÃO vs NEGAÇÃO de filho:
 - **Argumento 2** ("Filho em comum não caracteriza"): quando a defesa ADMITE que existe filho, mas NEGA que isso caracteriza união estável
@@ -462,96 +934,168 @@ Escolha um dos seguintes rótulos:
 
 3. Se existirem argumentos adicionais que não se enquadram nos 13 códigos acima, liste-os em "outros".
 
-### Formato de saída
-Responda apenas com JSON válido, sem explicações, sem Markdown, no seguinte formato:
+4. Liste em "alegacoes" TODAS as alegações apresentadas pela pensionista no Bloco 2, uma por item, cada uma resumida objetivamente em uma linha (sem numeração):
+- Inclua TUDO que a pessoa alega: negativas, explicações, provas apresentadas, argumentos jurídicos, mesmo que pareçam secundárias
+- Exemplos: "Nega ter mantido união estável", "Afirma inexistência de filho em comum", "Alega erro cadastral no CadÚnico", "Apresenta documentos comprobatórios", "Afirma relação eventual sem coabitação", "Apresenta depoimentos de terceiros", "Questiona bases cadastrais do TCU"
+- NUNCA retorne a lista vazia se houver texto de defesa para analisar
+
+### Exemplo de saída
 
 {{
   "achado": "rótulo escolhido",
   "argumentos": ["1","4","11"],
-  "outros": ["boa-fé", "segurança jurídica"]
+  "outros": ["boa-fé", "segurança jurídica"],
+  "alegacoes": ["Nega ter mantido união estável", "Apresenta documentos comprobatórios"]
 }}
 """
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
-    return resp.choices[0].message.content
-
-# --------- Extrair alegações do recurso em lista ---------
-def extrair_alegacoes_recurso(texto_defesa):
-    """Extrai as alegações/argumentos apresentados no recurso em formato de lista numerada."""
 
-    # Verifica se o texto é válido
-    if not texto_defesa or len(texto_defesa.strip()) < 50:
-        return "⚠️ ERRO: Não foi possível ler o conteúdo da defesa. O PDF pode estar corrompido, protegido ou em formato de imagem."
-
-    prompt = f"""
-Você é um especialista jurídico que analisa recursos administrativos de pensão.
-
-🚨 ATENÇÃO CRÍTICA: Sua tarefa é LER COM MÁXIMA ATENÇÃO e EXTRAIR TODAS as alegações do recurso.
-
-### Texto do Recurso:
-{texto_defesa}
-
-### Tarefa:
-Leia CUIDADOSAMENTE o texto acima e identifique TODAS as alegações/argumentos apresentados pela pensionista.
-
-**REGRAS OBRIGATÓRIAS:**
-1. Leia o TEXTO COMPLETO com atenção extrema
-2. Identifique e liste TODAS as alegações, mesmo que pareçam secundárias
-3. Inclua TUDO que a pessoa alega: negativas, explicações, provas apresentadas, argumentos jurídicos
-4. Formato: "1ª alegação - [resumo objetivo em uma linha]"
-5. NUNCA retorne "nenhuma alegação" se houver texto para analisar
-
-**Exemplos do que você DEVE identificar:**
-- "Nega união estável" → 1ª alegação - Nega ter mantido união estável
-- "Não tem filho em comum" → 2ª alegação - Afirma inexistência de filho em comum
-- "Cadastro feito por engano" → 3ª alegação - Alega erro cadastral no CadÚnico
-- "Junta certidões" → 4ª alegação - Apresenta documentos comprobatórios
-- "Relacionamento casual" → 5ª alegação - Afirma relação eventual sem coabitação
-- "Testemunhas confirmam" → 6ª alegação - Apresenta depoimentos de terceiros
-- "Erro nas bases" → 7ª alegação - Questiona bases cadastrais do TCU
+# Structured Outputs: a API garante JSON válido neste formato (sem cercas de Markdown)
+FORMATO_CLASSIFICACAO = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "classificacao_recurso",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "achado": {"type": "string", "enum": ACHADOS_TCU},
+                "argumentos": {"type": "array", "items": {"type": "string", "enum": list(ARG_MAP)}},
+                "outros": {"type": "array", "items": {"type": "string"}},
+                "alegacoes": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["achado", "argumentos", "outros", "alegacoes"],
+            "additionalProperties": False
+        }
+    }
+}
 
-🚨 IMPORTANTE: Se o texto contém alguma alegação, defesa ou argumento, você DEVE listar.
-⚠️ Use "Não foi possível identificar alegações específicas no texto fornecido" SOMENTE se o texto for completamente ilegível ou incoerente.
-"""
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
+def montar_mensagem_classificacao(descricao_indicio, texto_defesa):
+    return (
+        f"### Bloco 1 — Achado do TCU (descrição do indício)\n{limitar_tokens(descricao_indicio, LIMITE_TOKENS_EXTRATO)}\n\n"
+        f"### Bloco 2 — Defesa apresentada pela interessada\n{limitar_tokens(texto_defesa, LIMITE_TOKENS_DEFESA)}"
     )
-    return resp.choices[0].message.content
-
-# --------- GPT para narrativa formatada ---------
-def extrair_argumentos_formatado(texto_defesa):
-    prompt = f"""
-Você é um especialista jurídico que deve resumir um recurso administrativo.
 
-Leia o texto da DEFESA e produza um resumo organizado no seguinte formato:
+def classificar_com_gpt(descricao_indicio, texto_defesa, modelo=MODELO_GPT):
+    mensagem = montar_mensagem_classificacao(descricao_indicio, texto_defesa)
+    return consultar_gpt(PROMPT_SISTEMA_CLASSIFICACAO, mensagem, modelo=modelo, response_format=FORMATO_CLASSIFICACAO, max_tokens=MAX_TOKENS_CLASSIFICACAO)
 
-Recurso apresentado (trechos relevantes)
-
-[Nome do argumento]
-"trecho literal da defesa..."
-"outro trecho..."
-→ Argumento X — [descrição]
-
-Se houver argumento fora da lista (boa-fé, segurança jurídica, proteção da confiança etc.), inclua no final como:
+def classificar_com_escalonamento(descricao_indicio, texto_defesa):
+    """
+    Classifica com o modelo padrão (barato) e só repete com MODELO_GPT_ESCALONAMENTO
+    quando a resposta não é um JSON válido, vem cortada ou o achado fica "Achado não classificado".
+    Se a resposta do modelo maior também vier cortada, RespostaTruncadaError é propagada.
+    """
+    try:
+        saida = classificar_com_gpt(descricao_indicio, texto_defesa)
+    except RespostaTruncadaError:
+        saida = None
+    dados = ler_json_gpt(saida)
+    if dados is None or dados.get("achado") == "Achado não classificado":
+        saida = classificar_com_gpt(descricao_indicio, texto_defesa, modelo=MODELO_GPT_ESCALONAMENTO)
+    return saida
+
+# --------- Processamento em lote (Batch API) ---------
+# Estados finais de um lote; os demais (validating, in_progress, finalizing, cancelling) ainda estão em andamento
+STATUS_FINAIS_LOTE = {"completed", "failed", "expired", "cancelled"}
+# A Batch API aceita até 16 metadados por lote: os nomes dos recursos vão junto para que um lote
+# retomado pelo id em outra sessão ainda mostre de qual arquivo veio cada resultado
+MAX_METADADOS_LOTE = 16
+
+def montar_requisicao_lote(custom_id, sistema, mensagem, modelo=MODELO_GPT, response_format=None, max_tokens=None):
+    """Monta uma linha do JSONL da Batch API com os mesmos parâmetros (e a mesma normalização) usados em consultar_gpt."""
+    mensagem = normalizar_espacos(mensagem)
+    corpo = {
+        "model": modelo,
+        "messages": [
+            {"role": "system", "content": sistema},
+            {"role": "user", "content": mensagem}
+        ],
+        "temperature": 0
+    }
+    if response_format:
+        corpo["response_format"] = response_format
+    if max_tokens:
+        corpo["max_tokens"] = max_tokens
+    return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": corpo}
 
-Outro argumento não numerado
-"trecho literal..."
-→ Outro argumento não numerado
+def enviar_lote(pares):
+    """
+    Envia vários pares (nome, texto_extrato, texto_defesa) à Batch API da OpenAI.
+    Cada par gera duas requisições: identificação (extrato) e classificação (extrato + defesa).
+    O lote é processado em até 24h, com metade do custo e fora do limite de requisições por minuto.
+    Retorna o id do lote e o dicionário chave -> nome do recurso (também gravado nos metadados do lote).
+    """
+    requisicoes = []
+    nomes = {}
+    for nome, texto_extrato, texto_defesa in pares:
+        # Chave = hash da entrada normalizada: pares repetidos (mesmo com outra diagramação) viram uma única requisição
+        chave = hashlib.sha256(f"{normalizar_espacos(texto_extrato)}\x1f{normalizar_espacos(texto_defesa)}".encode("utf-8")).hexdigest()[:32]
+        if chave in nomes:
+            continue
+        nomes[chave] = nome
+        requisicoes.append(montar_requisicao_lote(
+            f"{chave}:identificacao", PROMPT_SISTEMA_IDENTIFICACAO, montar_mensagem_identificacao(texto_extrato),
+            modelo=MODELO_EXTRACAO, response_format=FORMATO_IDENTIFICACAO, max_tokens=MAX_TOKENS_IDENTIFICACAO
+        ))
+        requisicoes.append(montar_requisicao_lote(
+            f"{chave}:classificacao", PROMPT_SISTEMA_CLASSIFICACAO,
+            montar_mensagem_classificacao(recortar_trechos_indicio(texto_extrato), texto_defesa),
+            response_format=FORMATO_CLASSIFICACAO, max_tokens=MAX_TOKENS_CLASSIFICACAO
+        ))
+
+    jsonl = BytesIO("\n".join(json.dumps(r, ensure_ascii=False) for r in requisicoes).encode("utf-8"))
+    arquivo = client.files.create(file=("lote_recursos.jsonl", jsonl), purpose="batch")
+    metadados = {chave: nome[:512] for chave, nome in list(nomes.items())[:MAX_METADADOS_LOTE]}
+    lote = client.batches.create(input_file_id=arquivo.id, endpoint="/v1/chat/completions", completion_window="24h", metadata=metadados)
+    return lote.id, nomes
+
+def _ler_jsonl_lote(arquivo_id):
+    """Linhas (dict) de um arquivo JSONL de saída ou de erros de um lote."""
+    conteudo = client.files.content(arquivo_id).text
+    return [json.loads(linha) for linha in conteudo.splitlines() if linha.strip()]
+
+def _erro_requisicao_lote(item):
+    """Mensagem de erro de uma linha do lote, ou None se a requisição foi atendida."""
+    if item.get("error"):
+        return item["error"].get("message") or str(item["error"])
+    resposta = item.get("response") or {}
+    if resposta.get("status_code", 200) != 200:
+        erro = (resposta.get("body") or {}).get("error") or {}
+        return erro.get("message") or f"HTTP {resposta.get('status_code')}"
+    return None
 
-### Texto da defesa:
-{texto_defesa}
-"""
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
-    return resp.choices[0].message.content
+def ler_resultados_lote(lote):
+    """
+    Baixa a saída de um lote finalizado e retorna (resultados, erros):
+    custom_id -> resposta (dict) e custom_id -> mensagem de erro.
+    As requisições que falharam vêm no arquivo de erros (error_file_id), que existe mesmo sem arquivo de saída.
+    """
+    resultados = {}
+    erros = {}
+    linhas = []
+    if lote.output_file_id:
+        linhas += _ler_jsonl_lote(lote.output_file_id)
+    if lote.error_file_id:
+        linhas += _ler_jsonl_lote(lote.error_file_id)
+
+    for item in linhas:
+        erro = _erro_requisicao_lote(item)
+        if erro:
+            erros[item["custom_id"]] = erro
+            continue
+        try:
+            conteudo_resposta = item["response"]["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            conteudo_resposta = None
+        resultados[item["custom_id"]] = ler_json_gpt(conteudo_resposta) or {}
+    return resultados, erros
+
+def retomar_lote():
+    """Callback do campo de id: passa a acompanhar um lote enviado em outra sessão."""
+    lote_id = st.session_state.lote_id_digitado.strip()
+    if lote_id:
+        st.session_state.lote_id = lote_id
+        st.session_state.lote_nomes = {}
 
 # --------- Recalcular achado baseado na defesa ---------
 def recalcular_achado(achado_original, argumentos):
@@ -587,27 +1131,24 @@ def analisar_com_matriz(achado, argumentos):
     # PRIMEIRO: Recalcular achado se defesa revelar mais provas
     achado_recalculado = recalcular_achado(achado, argumentos)
 
-    improc, proc = [], []
+    regras = carregar_regras_matriz()
 
     # Se não há argumentos, buscar regra "Nenhum argumento apresentado"
     if not argumentos or len(argumentos) == 0:
-        regra = matriz[(matriz["achado"] == achado_recalculado) & (matriz["argumento"] == "Nenhum argumento apresentado")]
-        if not regra.empty:
-            res = regra["resultado"].iloc[0]
+        res = regras.get((achado_recalculado, "Nenhum argumento apresentado"))
+        if res is not None:
             saida1 = res
             mensagem_achado = f" (achado original: {achado})" if achado != achado_recalculado else ""
             saida2 = f"Decisão baseada em: {achado_recalculado}{mensagem_achado} + Nenhum argumento apresentado = {res}"
             return saida1, saida2
 
-    # Se há argumentos, processar normalmente
-    for num in argumentos:
-        arg_texto = ARG_MAP.get(num, num)
-        regra = matriz[(matriz["achado"] == achado_recalculado) & (matriz["argumento"] == arg_texto)]
-        if regra.empty:
-            regra = matriz[(matriz["achado"] == "Qualquer achado") & (matriz["argumento"] == arg_texto)]
-        if not regra.empty:
-            res = regra["resultado"].iloc[0]
-            (improc if res == "improcedente" else proc).append(num)
+    # Se há argumentos, processar normalmente: regra do achado, senão a de "Qualquer achado"
+    resultados = [
+        (num, regras.get((achado_recalculado, ARG_MAP[num]), regras.get(("Qualquer achado", ARG_MAP[num]))))
+        for num in argumentos if num in ARG_MAP
+    ]
+    improc = [num for num, res in resultados if res == "improcedente"]
+    proc = [num for num, res in resultados if res is not None and res != "improcedente"]
 
     # Argumentos com prevalência absoluta (sempre procedente)
     # Adicionar explicitamente à lista proc para exibição
@@ -660,108 +1201,146 @@ def analisar_com_matriz(achado, argumentos):
     return saida1, saida2, improc, proc
 
 # --------- Gerar corpo do ofício ---------
-def gerar_corpo_oficio(decisao, achado, argumentos, outros, alegacoes, texto_defesa_previa, dados_identificacao, descricao_indicio):
-    """
-    Gera o corpo do ofício usando GPT com RAG (Retrieval-Augmented Generation).
-    O GPT lê os textos dos templates item 15 e 13 e gera APENAS o item 15/13 (análise dos argumentos).
-    """
-    try:
-        from templates_textos import (
-            ITEM15_ACHADOS, ITEM15_ARGUMENTOS,
-            ITEM13_ACHADOS, ITEM13_ARGUMENTOS
-        )
-    except ImportError:
-        return "ERRO: Arquivo templates_textos.py não encontrado. Verifique se o arquivo existe no diretório."
-
-    # Preparar lista de argumentos apresentados
-    args_lista = "\n".join([f"- Argumento {num}: {ARG_MAP.get(num, 'Não identificado')}" for num in argumentos])
-
-    # Selecionar templates conforme decisão
-    if decisao == "improcedente":
-        dict_achados = ITEM15_ACHADOS
-        dict_argumentos = ITEM15_ARGUMENTOS
-        item_num = "15"
-    else:
-        dict_achados = ITEM13_ACHADOS
-        dict_argumentos = ITEM13_ARGUMENTOS
-        item_num = "13"
-
-    # Montar textos de referência do template
-    texto_achado_ref = dict_achados.get(achado, "[Achado não encontrado no template]")
-
-    textos_args_ref = []
-    for num in argumentos:
-        texto_arg = dict_argumentos.get(num)
-        if texto_arg:
-            arg_nome = ARG_MAP.get(num, f"Argumento {num}")
-            textos_args_ref.append(f"**{arg_nome}:**\n{texto_arg}")
-
-    textos_args_formatados = "\n\n".join(textos_args_ref) if textos_args_ref else "[Nenhum argumento mapeado no template]"
-
-    prompt = f"""
-Você é um sistema de montagem de documentos que usa textos literais pré-definidos.
+# Instruções fixas do ofício: idênticas em toda chamada (prefixo reaproveitável pelo cache de prompt da OpenAI)
+PROMPT_SISTEMA_OFICIO = """Você é um sistema de montagem de documentos que usa textos literais pré-definidos.
 
 ### INSTRUÇÕES CRÍTICAS
-Gere APENAS o ITEM {item_num} usando EXATAMENTE os textos fornecidos abaixo.
+Gere APENAS o item indicado na tarefa usando EXATAMENTE os textos fornecidos.
 NÃO gere item 16, conclusão ou outros parágrafos.
 
-### ARGUMENTOS DO CASO
-{args_lista}
+### FORMATO
+**PRIMEIRO:** Cole o texto literal do achado
 
-### TEXTOS LITERAIS (COPIE EXATAMENTE COMO ESTÃO)
-
-#### TEXTO PARA O ACHADO "{achado}":
-{texto_achado_ref}
-
-#### TEXTOS PARA CADA ARGUMENTO:
-{textos_args_formatados}
-
-### TAREFA
-Monte o item {item_num} no seguinte formato:
-
-**{item_num}. Dos argumentos apresentados no recurso pela Interessada, segue análise:**
-
-**PRIMEIRO:** Cole o texto literal do achado "{achado}"
-
-**DEPOIS:** Para cada argumento na lista acima:
+**DEPOIS:** Para cada argumento da lista:
 - Adicione o título do argumento
 - Cole o texto literal fornecido para aquele argumento
 - Pule uma linha
 
 **REGRAS ABSOLUTAS:**
-- Gere APENAS o item {item_num}
+- Gere APENAS o item indicado
 - SEMPRE comece com o texto do achado
 - Depois adicione os textos dos argumentos
 - NÃO inclua item 16
 - NÃO inclua conclusão (parágrafos 17-20)
 - USE os textos LITERAIS - NÃO reescreva
 - NÃO invente textos novos
-- PARE após o último argumento
-"""
+- PARE após o último argumento"""
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.1  # Baixa temperatura para manter fidelidade aos templates
+# Parte variável do ofício: preenchida por substitute() a cada geração
+PROMPT_OFICIO = Template("""### ARGUMENTOS DO CASO
+$args_lista
+
+### TEXTOS LITERAIS (COPIE EXATAMENTE COMO ESTÃO)
+
+#### TEXTO PARA O ACHADO "$achado":
+$texto_achado_ref
+
+#### TEXTOS PARA CADA ARGUMENTO:
+$textos_args_formatados
+
+### TAREFA
+Monte o item $item_num, começando por:
+
+**$item_num. Dos argumentos apresentados no recurso pela Interessada, segue análise:**""")
+
+# Textos literais do ofício, montados uma vez: item -> (textos dos achados, bloco "**título:**\ntexto" de cada argumento)
+try:
+    from templates_textos import (
+        ITEM15_ACHADOS, ITEM15_ARGUMENTOS,
+        ITEM13_ACHADOS, ITEM13_ARGUMENTOS
     )
 
-    return resp.choices[0].message.content
+    TEXTOS_OFICIO = {
+        item_num: (achados, {
+            num: f"**{ARG_MAP.get(num, f'Argumento {num}')}:**\n{texto}"
+            for num, texto in argumentos.items() if texto
+        })
+        for item_num, achados, argumentos in (
+            ("15", ITEM15_ACHADOS, ITEM15_ARGUMENTOS),
+            ("13", ITEM13_ACHADOS, ITEM13_ARGUMENTOS)
+        )
+    }
+except ImportError:
+    TEXTOS_OFICIO = None
+
+# Linha de cada argumento na lista do caso
+LINHAS_ARGUMENTOS = {num: f"- Argumento {num}: {nome}" for num, nome in ARG_MAP.items()}
 
-# --------- Carregar logo em base64 ---------
-def get_logo_base64():
-    """Carrega robo.png de forma compatível com Streamlit Cloud e local."""
+def gerar_corpo_oficio(decisao, achado, argumentos, outros, alegacoes, texto_defesa_previa, identificacao):
+    """
+    Gera o corpo do ofício usando GPT com RAG (Retrieval-Augmented Generation).
+    O GPT lê os textos dos templates item 15 e 13 e gera APENAS o item 15/13 (análise dos argumentos).
+    A resposta é devolvida em trechos (gerador), para ser exibida com st.write_stream enquanto é gerada.
+    """
+    if TEXTOS_OFICIO is None:
+        yield "ERRO: Arquivo templates_textos.py não encontrado. Verifique se o arquivo existe no diretório."
+        return
+
+    # Preparar lista de argumentos apresentados
+    args_lista = "\n".join(LINHAS_ARGUMENTOS.get(num, f"- Argumento {num}: Não identificado") for num in argumentos)
+
+    # Selecionar templates conforme decisão
+    item_num = "15" if decisao == "improcedente" else "13"
+    dict_achados, blocos_argumentos = TEXTOS_OFICIO[item_num]
+
+    # Montar textos de referência do template
+    texto_achado_ref = dict_achados.get(achado, "[Achado não encontrado no template]")
+
+    textos_args_ref = [blocos_argumentos[num] for num in argumentos if num in blocos_argumentos]
+    textos_args_formatados = "\n\n".join(textos_args_ref) if textos_args_ref else "[Nenhum argumento mapeado no template]"
+
+    mensagem = PROMPT_OFICIO.substitute(
+        item_num=item_num,
+        args_lista=args_lista,
+        achado=achado,
+        texto_achado_ref=texto_achado_ref,
+        textos_args_formatados=textos_args_formatados
+    )
+
+    # Baixa temperatura para manter fidelidade aos templates
+    yield from transmitir_gpt(PROMPT_SISTEMA_OFICIO, mensagem, temperature=0.1)
+
+# --------- Texto livre exibido em markdown ---------
+def texto_markdown(texto):
+    """Escapa "$" (o Markdown do Streamlit o trata como LaTeX) e preserva as quebras de linha."""
+    return texto.replace("$", "\\$").replace("\n", "  \n")
+
+# --------- Blocos HTML da interface ---------
+# Montados uma vez; a cada execução só o valor é preenchido com format()
+CARD_DADO = (
+    '<div style="background: #ffffff; padding: 1rem; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.05); border: 1px solid #e5e7eb; border-left: 4px solid #2563eb;">'
+    '<div style="color: #2563eb; font-size: 0.75rem; font-family: \'Inter\', sans-serif; font-weight: 700; text-transform: uppercase; letter-spacing: 0.5px;">{rotulo}</div>'
+    '<div style="color: #1f2937; font-size: 0.9rem; margin-top: 0.5rem; font-weight: 500; line-height: 1.4;">{valor}</div>'
+    '</div>'
+)
+
+# Grade responsiva: 3 colunas em telas largas, empilha em telas estreitas
+GRADE_CARDS = '<div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 1rem;">{cards}</div>'
+
+CORPO_OFICIO_HTML = (
+    '<div style="background-color: #ffffff; color: #000000; line-height: 1.8; font-size: 14px; '
+    'text-align: justify; padding: 20px; border-radius: 8px; border: 1px solid #00d9ff;">'
+    '{corpo}'
+    '</div>'
+)
+
+# --------- Carregar logo ---------
+@st.cache_data(show_spinner=False)
+def get_logo_robo():
+    """
+    Carrega os bytes de robo.png de forma compatível com Streamlit Cloud e local, uma única vez por processo.
+    Exibido com st.image, o logo é servido como arquivo de mídia em vez de base64 dentro do HTML.
+    """
     try:
         # Caminho relativo à pasta do app.py
         path_local = Path(__file__).parent / "robo.png"
         if path_local.exists():
-            with open(path_local, "rb") as img_file:
-                return base64.b64encode(img_file.read()).decode()
+            return path_local.read_bytes()
 
         # Caminho alternativo: subpasta "assets"
         path_assets = Path(__file__).parent / "assets" / "robo.png"
         if path_assets.exists():
-            with open(path_assets, "rb") as img_file:
-                return base64.b64encode(img_file.read()).decode()
+            return path_assets.read_bytes()
 
         # Caso não encontre, mostra aviso
         st.warning("⚠️ Logo do robô não encontrado (robo.png). Exibindo título padrão.")
@@ -770,10 +1349,121 @@ def get_logo_base64():
         st.error(f"❌ Erro ao carregar logo: {e}")
         return None
 
+# --------- Avaliação da análise (feedback) ---------
+# Os botões Enviar/Cancelar usam callbacks: eles rodam antes da reexecução do fragmento,
+# então o bloco já é redesenhado com o campo fechado (ou com o erro), sem st.rerun
+def fechar_feedback(campo):
+    """Callback dos botões Cancelar: fecha o campo de sugestão ou de comentário."""
+    st.session_state[campo] = False
+
+def enviar_feedback(dados, avaliacao):
+    """Callback dos botões Enviar Feedback: monta o registro e agenda o envio ao B2."""
+    correto = avaliacao == 'correto'
+    comentario = st.session_state.get('sugestao_feedback' if correto else 'comentario_feedback') or ''
+
+    # Validar se comentário foi preenchido (obrigatório na análise incorreta)
+    if not correto and not comentario.strip():
+        st.session_state.erro_feedback = "⚠️ Por favor, descreva o que estava incorreto. Este campo é obrigatório."
+        return
+
+    feedback = {
+        'timestamp': datetime.now(),
+        'codigo': dados['codigo'],
+        'nome': dados['nome'],
+        'decisao': dados['decisao'],
+        'achado': st.session_state.get('achado_atual', 'N/A'),
+        'avaliacao': avaliacao,
+        'comentario': comentario,
+        'corpo_oficio': st.session_state.corpo_oficio
+    }
+
+    # Gravar somente o novo feedback no B2, em segundo plano
+    if not enviar_feedback_b2(feedback):
+        st.session_state.erro_feedback = "❌ Backblaze B2 não está configurado. Configure os secrets no Streamlit Cloud."
+        return
+
+    if correto:
+        st.session_state.aviso_feedback = "✅ Obrigado! Feedback recebido; o envio ao B2 segue em segundo plano."
+        st.session_state.mostrar_sugestao = False
+    else:
+        st.session_state.aviso_feedback = "✅ Obrigado pelo feedback! Isso nos ajudará a melhorar."
+        st.session_state.mostrar_comentario = False
+
+@st.fragment
+def bloco_feedback(dados):
+    """
+    Botões e campos de feedback da barra lateral. Como fragmento, cliques e digitação
+    aqui reexecutam só este bloco, sem refazer as etapas da análise.
+    """
+    # Avisos do feedback enviado em segundo plano
+    if 'aviso_feedback' in st.session_state:
+        st.toast(st.session_state.pop('aviso_feedback'))
+    verificar_envios_feedback()
+
+    st.markdown("### 💬 Avaliação da Análise")
+    st.caption("Sua avaliação ajuda a melhorar o sistema")
+
+    col_feedback1, col_feedback2 = st.columns(2)
+
+    with col_feedback1:
+        if st.button("✅ Análise Correta", key="feedback_correto", use_container_width=True, type="primary"):
+            # Ativar modo de sugestão opcional
+            st.session_state.mostrar_sugestao = True
+
+    with col_feedback2:
+        if st.button("❌ Análise Incorreta", key="feedback_incorreto", use_container_width=True):
+            # Abrir campo para comentário obrigatório
+            st.session_state.mostrar_comentario = True
+
+    # Campo de sugestão (OPCIONAL - análise correta)
+    if st.session_state.get('mostrar_sugestao', False):
+        st.success("✅ **Análise marcada como CORRETA**")
+
+        st.text_area(
+            "💡 Deseja sugerir melhorias? (opcional)",
+            placeholder="Se tiver alguma sugestão de melhoria, compartilhe conosco...",
+            key="sugestao_feedback",
+            height=80
+        )
+
+        col_env1, col_env2 = st.columns(2)
+        with col_env1:
+            # Salvar feedback positivo com sugestão opcional
+            st.button("Enviar Feedback", key="enviar_sugestao", type="primary", use_container_width=True,
+                      on_click=enviar_feedback, args=(dados, 'correto'))
+        with col_env2:
+            st.button("Cancelar", key="cancelar_sugestao", use_container_width=True,
+                      on_click=fechar_feedback, args=('mostrar_sugestao',))
+
+    # Campo de comentário (OBRIGATÓRIO - análise incorreta)
+    if st.session_state.get('mostrar_comentario', False):
+        st.error("❌ **Análise marcada como INCORRETA**")
+
+        st.text_area(
+            "⚠️ O que estava incorreto? (obrigatório)",
+            placeholder="Descreva o problema encontrado na análise. Este campo é OBRIGATÓRIO.",
+            key="comentario_feedback",
+            height=100
+        )
+
+        col_env1, col_env2 = st.columns(2)
+        with col_env1:
+            # Salvar feedback negativo com comentário
+            st.button("Enviar Feedback", key="enviar_comentario", type="primary", use_container_width=True,
+                      on_click=enviar_feedback, args=(dados, 'incorreto'))
+        with col_env2:
+            st.button("Cancelar", key="cancelar_comentario", use_container_width=True,
+                      on_click=fechar_feedback, args=('mostrar_comentario',))
+
+    # Erro do último envio (comentário vazio ou B2 não configurado)
+    if 'erro_feedback' in st.session_state:
+        st.error(st.session_state.pop('erro_feedback'))
+
 # ------------------ INTERFACE ------------------
 
 # CSS Customizado - Tema Institucional Moderno MGI/ENAP/TCU
-st.markdown("""
+# Folha de estilo única do app (tema, cabeçalho, sidebar e feedback), injetada uma vez por execução
+CSS_APP = """
 <style>
 /* Importar fonte Inter (moderna e institucional) */
 @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
@@ -864,6 +1554,7 @@ h2::before {
 
 /* ====== LOGO DO ROBÔ ====== */
 img[alt="robo"], .logo-robo-pulse {
+    margin-top: 10px;
     width: 120px !important;
     height: auto !important;
     mix-blend-mode: multiply !important;
@@ -1116,35 +1807,8 @@ div[data-testid="column"] button[kind="secondary"] {
 .stRadio div[role="radiogroup"] p {
     color: #1f2937 !important;
 }
-</style>
-""", unsafe_allow_html=True)
-
-# =========================
-# CABEÇALHO FINAL — VERSÃO INSTITUCIONAL AJUSTADA
-# =========================
-logo_base64 = get_logo_base64()
-
-# Faixa institucional superior
-st.markdown("""
-<div style="
-    background:#1e3a8a;
-    color:#ffffff;
-    font-family:'Inter',sans-serif;
-    font-weight:600;
-    font-size:14px;
-    letter-spacing:0.5px;
-    padding:6px 18px;
-    border-radius:6px 6px 0 0;
-    text-align:left;
-    box-shadow:0 2px 4px rgba(0,0,0,0.1);
-">
-    DECIPEX — Coordenação-Geral de Risco e Controle
-</div>
-""", unsafe_allow_html=True)
 
-# CSS para estilização dos botões na terceira coluna
-st.markdown("""
-<style>
+/* ====== BOTÕES DO CABEÇALHO (terceira coluna) ====== */
 /* 🔹 Alinha botões à direita, com proporção harmoniosa */
 div[data-testid="column"]:nth-child(3) .stButton > button {
     background: linear-gradient(135deg, #1e3a8a 0%, #2563eb 100%) !important;
@@ -1166,17 +1830,70 @@ div[data-testid="stHorizontalBlock"] {
     margin-top: 0 !important;
     margin-bottom: 0 !important;
 }
+
+/* ====== SIDEBAR (largura) ====== */
+[data-testid="stSidebar"] {
+    min-width: 50% !important;
+    max-width: 50% !important;
+}
+
+/* ====== BOTÕES DE FEEDBACK ====== */
+/* Selecionados pela classe st-key-<key> que o Streamlit põe nos widgets com key */
+/* Botão verde para análise correta */
+.st-key-feedback_correto .stButton button[kind="primary"] {
+    background: #28a745 !important;
+    border-color: #28a745 !important;
+    color: white !important;
+}
+.st-key-feedback_correto .stButton button[kind="primary"]:hover {
+    background: #218838 !important;
+    border-color: #1e7e34 !important;
+}
+
+/* Botão vermelho para análise incorreta */
+.st-key-feedback_incorreto .stButton button[kind="secondary"] {
+    background: #dc3545 !important;
+    border-color: #dc3545 !important;
+    color: white !important;
+}
+.st-key-feedback_incorreto .stButton button[kind="secondary"]:hover {
+    background: #c82333 !important;
+    border-color: #bd2130 !important;
+}
 </style>
+"""
+st.markdown(CSS_APP, unsafe_allow_html=True)
+
+# =========================
+# CABEÇALHO FINAL — VERSÃO INSTITUCIONAL AJUSTADA
+# =========================
+logo_robo = get_logo_robo()
+
+# Faixa institucional superior
+st.markdown("""
+<div style="
+    background:#1e3a8a;
+    color:#ffffff;
+    font-family:'Inter',sans-serif;
+    font-weight:600;
+    font-size:14px;
+    letter-spacing:0.5px;
+    padding:6px 18px;
+    border-radius:6px 6px 0 0;
+    text-align:left;
+    box-shadow:0 2px 4px rgba(0,0,0,0.1);
+">
+    DECIPEX — Coordenação-Geral de Risco e Controle
+</div>
 """, unsafe_allow_html=True)
 
 # Cabeçalho com botões integrados (layout 3 colunas)
 col_logo, col_titulo, col_botoes = st.columns([1.2, 4, 2])
 
 with col_logo:
-    st.markdown(f"""
-    <img src="data:image/png;base64,{logo_base64}" alt="robo" class="logo-robo-pulse"
-         style="width:120px; height:auto; margin-top:10px;">
-    """, unsafe_allow_html=True)
+    if logo_robo:
+        # alt="robo": o mesmo seletor do CSS_APP que estilizava a <img> inline
+        st.image(logo_robo, width=120, alt="robo")
 
 with col_titulo:
     st.markdown("""
@@ -1214,7 +1931,14 @@ with col_botoes:
 
                 # Insights
                 st.markdown("### 💡 Insights e Recomendações")
-                st.markdown(resultado['insights'])
+                if isinstance(resultado['insights'], str):
+                    st.markdown(resultado['insights'])
+                else:
+                    # A conexão pode cair no meio da transmissão
+                    try:
+                        st.write_stream(resultado['insights'])
+                    except Exception as e:
+                        st.error(f"❌ Erro ao processar feedbacks: {e}")
 
                 st.divider()
 
@@ -1240,8 +1964,7 @@ with col_botoes:
     # Botão Limpar
     if st.button("🔄 Limpar", help="Limpar tudo e recomeçar", type="secondary", use_container_width=True, key="btn_reiniciar"):
         # Limpar session_state
-        for key in list(st.session_state.keys()):
-            del st.session_state[key]
+        st.session_state.clear()
         st.rerun()
 
 # Aviso se B2 não estiver configurado
@@ -1261,9 +1984,99 @@ with col_upload2:
     st.markdown("### 2️⃣ PDF do Recurso")
     defesa_file = st.file_uploader("Selecione o arquivo PDF do recurso", type=["pdf"], key="recurso", label_visibility="collapsed")
 
+# Processamento em lote: enfileira vários recursos e consulta o resultado depois
+with st.expander("📦 Processamento em lote (vários recursos)"):
+    st.caption("Os extratos e recursos são pareados pela ordem alfabética dos nomes dos arquivos. O resultado fica pronto em até 24h, com custo reduzido.")
+    extratos_lote = st.file_uploader("PDFs dos extratos", type=["pdf"], accept_multiple_files=True, key="extratos_lote")
+    recursos_lote = st.file_uploader("PDFs dos recursos", type=["pdf"], accept_multiple_files=True, key="recursos_lote")
+
+    if extratos_lote and recursos_lote and len(extratos_lote) != len(recursos_lote):
+        st.warning("⚠️ Envie a mesma quantidade de extratos e recursos.")
+
+    if st.button("📤 Enfileirar lote", key="btn_enfileirar_lote", disabled=not extratos_lote or not recursos_lote or len(extratos_lote) != len(recursos_lote)):
+        pares = []
+        for extrato, recurso in zip(sorted(extratos_lote, key=lambda f: f.name), sorted(recursos_lote, key=lambda f: f.name)):
+            texto_extrato_lote, texto_recurso_lote = executar_em_paralelo((extrair_texto, extrato), (extrair_texto, recurso))
+            if texto_extrato_lote and texto_recurso_lote:
+                pares.append((recurso.name, texto_extrato_lote, texto_recurso_lote))
+            else:
+                st.warning(f"⚠️ Par ignorado (texto não extraído): {extrato.name} / {recurso.name}")
+
+        if pares:
+            with st.spinner("📤 Enviando lote..."):
+                st.session_state.lote_id, st.session_state.lote_nomes = enviar_lote(pares)
+            st.success(f"✅ Lote enviado com {len(st.session_state.lote_nomes)} recurso(s). Volte mais tarde para verificar o status.")
+
+    # O id do lote fica só nesta sessão: para acompanhar um lote enviado antes (recarga da página,
+    # "Limpar" ou outro dia), basta informar o id mostrado no envio
+    st.text_input("ID de um lote já enviado", key="lote_id_digitado", placeholder="batch_...", on_change=retomar_lote)
+
+    if "lote_id" in st.session_state:
+        st.caption(f"Lote atual: `{st.session_state.lote_id}`")
+        if st.button("🔄 Verificar status", key="btn_status_lote"):
+            resultados = erros = None
+            with st.status("🔄 Consultando o lote...") as status_lote:
+                try:
+                    lote = client.batches.retrieve(st.session_state.lote_id)
+                except Exception as e:
+                    lote = None
+                    status_lote.update(label=f"❌ Erro ao consultar o lote: {e}", state="error")
+
+                if lote is not None and lote.status not in STATUS_FINAIS_LOTE:
+                    contagem = lote.request_counts
+                    andamento = f" ({contagem.completed}/{contagem.total} requisições concluídas)" if contagem else ""
+                    status_lote.update(label=f"⏳ Status do lote: {lote.status}{andamento}", state="running")
+                elif lote is not None:
+                    resultados, erros = ler_resultados_lote(lote)
+                    if lote.status == "completed" and resultados:
+                        com_erro = f" ({len(erros)} requisição(ões) com erro)" if erros else ""
+                        status_lote.update(label=f"✅ Lote concluído{com_erro}", state="complete", expanded=True)
+                    else:
+                        status_lote.update(label=f"❌ Lote encerrado sem resultados ({lote.status})", state="error", expanded=True)
+                    # Erros do lote como um todo (p.ex. arquivo de entrada inválido)
+                    for erro_lote in (lote.errors.data if lote.errors and lote.errors.data else []):
+                        st.error(f"❌ {erro_lote.message}")
+
+            if resultados or erros:
+                # Nomes da sessão atual ou, para um lote retomado pelo id, dos metadados do lote
+                nomes = st.session_state.lote_nomes or dict(lote.metadata or {})
+                chaves = list(dict.fromkeys([*nomes, *(c.split(":")[0] for c in [*resultados, *erros])]))
+                linhas_lote = []
+                for chave in chaves:
+                    identificacao = resultados.get(f"{chave}:identificacao", {})
+                    classificacao = resultados.get(f"{chave}:classificacao", {})
+                    falhas = dict.fromkeys(erros[c] for c in (f"{chave}:identificacao", f"{chave}:classificacao") if c in erros)
+                    linhas_lote.append({
+                        "Recurso": nomes.get(chave, chave),
+                        "Nome": identificacao.get("nome"),
+                        "CPF": identificacao.get("cpf"),
+                        "Achado (GPT)": classificacao.get("achado", "Sem resultado"),
+                        "Argumentos (GPT, sem validação)": ", ".join(classificacao.get("argumentos", [])),
+                        "Outros": ", ".join(classificacao.get("outros", [])),
+                        "Erro": "; ".join(falhas)
+                    })
+                st.caption(
+                    "⚠️ Classificação bruta do GPT: os argumentos não passaram pelas validações da análise individual "
+                    "(argumentos 4, 6, 9, 12 e 13) nem pela matriz de decisão. Para a decisão, analise cada recurso individualmente."
+                )
+                st.dataframe(pd.DataFrame(linhas_lote), hide_index=True, use_container_width=True)
+
+# A análise só começa a pedido; depois segue liberada enquanto os mesmos PDFs estiverem carregados
+analise_liberada = False
 if extrato_file and defesa_file:
-    texto_extrato = extrair_texto(extrato_file)
-    texto_defesa = extrair_texto(defesa_file)
+    pdfs_atuais = (extrato_file.file_id, defesa_file.file_id)
+    if st.session_state.get("pdfs_analisados") == pdfs_atuais:
+        analise_liberada = True
+    elif st.button("🔎 Analisar recurso", key="btn_analisar", type="primary"):
+        st.session_state.pdfs_analisados = pdfs_atuais
+        analise_liberada = True
+
+if analise_liberada:
+    # Os dois PDFs são independentes: extrair em paralelo
+    texto_extrato, texto_defesa = executar_em_paralelo(
+        (extrair_texto, extrato_file),
+        (extrair_texto, defesa_file),
+    )
 
     # Validação da extração de texto
     if not texto_extrato:
@@ -1277,17 +2090,17 @@ if extrato_file and defesa_file:
 
     # --- Extrair dados de identificação ---
     with st.spinner("🔎 Extraindo dados de identificação..."):
-        saida_identificacao = extrair_dados_identificacao(texto_extrato)
-
-    try:
-        saida_limpa_id = saida_identificacao.strip()
-        if saida_limpa_id.startswith("```"):
-            saida_limpa_id = saida_limpa_id.strip("`")
-            saida_limpa_id = saida_limpa_id.replace("json", "", 1).strip()
-        dados_identificacao = json.loads(saida_limpa_id)
-    except Exception:
-        st.error(f"⚠️ Erro ao extrair dados de identificação. Retorno bruto:\n{saida_identificacao}")
-        dados_identificacao = {"nome": None, "cpf": None, "codigo_indicio": None}
+        try:
+            saida_identificacao = extrair_dados_identificacao(texto_extrato)
+        except RespostaTruncadaError as e:
+            # Sem cache: reenviar os PDFs tenta de novo
+            saida_identificacao = e.parcial
+
+    dados_identificacao = ler_json_gpt(saida_identificacao)
+    if dados_identificacao is None:
+        st.error(f"⚠️ Erro ao extrair dados de identificação. Retorno bruto:\n{(saida_identificacao or '')[:500]}")
+        dados_identificacao = {}
+    identificacao = resolver_identificacao(dados_identificacao)
 
     # 3. Dados da Pensionista
     col_header3, col_copy3 = st.columns([9, 1])
@@ -1298,43 +2111,21 @@ if extrato_file and defesa_file:
     st.error("🚨 **ATENÇÃO:** Não esqueça de alterar o **ITEM 1** da Nota Técnica no SEI com estes dados!")
 
     with col_copy3:
-        nome = dados_identificacao.get("nome", "Não identificado")
-        cpf = dados_identificacao.get("cpf", "Não identificado")
-        codigo = dados_identificacao.get("codigo_indicio", "Não identificado")
-        dados_texto = f"Nome: {nome}\nCPF: {cpf}\nCódigo: {codigo}"
+        dados_texto = f"Nome: {identificacao.nome}\nCPF: {identificacao.cpf}\nCódigo: {identificacao.codigo}"
         if st.button("📋", key="copy_dados", help="Copiar dados da pensionista"):
             st.code(dados_texto, language=None)
 
-    # Layout em 3 colunas para dados compactos
-    col_nome, col_cpf, col_codigo = st.columns(3)
-    with col_nome:
-        st.markdown(f"""
-        <div style="background: #ffffff; padding: 1rem; border-radius: 10px; border-left: 4px solid #2563eb; box-shadow: 0 2px 10px rgba(0,0,0,0.05); border: 1px solid #e5e7eb; border-left: 4px solid #2563eb;">
-            <div style="color: #2563eb; font-size: 0.75rem; font-family: 'Inter', sans-serif; font-weight: 700; text-transform: uppercase; letter-spacing: 0.5px;">Nome</div>
-            <div style="color: #1f2937; font-size: 0.9rem; margin-top: 0.5rem; font-weight: 500; line-height: 1.4;">{nome}</div>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col_cpf:
-        st.markdown(f"""
-        <div style="background: #ffffff; padding: 1rem; border-radius: 10px; border-left: 4px solid #2563eb; box-shadow: 0 2px 10px rgba(0,0,0,0.05); border: 1px solid #e5e7eb; border-left: 4px solid #2563eb;">
-            <div style="color: #2563eb; font-size: 0.75rem; font-family: 'Inter', sans-serif; font-weight: 700; text-transform: uppercase; letter-spacing: 0.5px;">CPF</div>
-            <div style="color: #1f2937; font-size: 0.9rem; margin-top: 0.5rem; font-weight: 500;">{cpf}</div>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col_codigo:
-        st.markdown(f"""
-        <div style="background: #ffffff; padding: 1rem; border-radius: 10px; border-left: 4px solid #2563eb; box-shadow: 0 2px 10px rgba(0,0,0,0.05); border: 1px solid #e5e7eb; border-left: 4px solid #2563eb;">
-            <div style="color: #2563eb; font-size: 0.75rem; font-family: 'Inter', sans-serif; font-weight: 700; text-transform: uppercase; letter-spacing: 0.5px;">Código Indício</div>
-            <div style="color: #1f2937; font-size: 0.9rem; margin-top: 0.5rem; font-weight: 500;">{codigo}</div>
-        </div>
-        """, unsafe_allow_html=True)
+    # Os 3 cards em uma única grade (um só elemento, em vez de colunas + 3 markdowns)
+    st.markdown(GRADE_CARDS.format(cards=(
+        CARD_DADO.format(rotulo="Nome", valor=identificacao.nome)
+        + CARD_DADO.format(rotulo="CPF", valor=identificacao.cpf)
+        + CARD_DADO.format(rotulo="Código Indício", valor=identificacao.codigo)
+    )), unsafe_allow_html=True)
 
     st.markdown("<br>", unsafe_allow_html=True)
 
     # 4. Descrição do Indício (TCU)
-    descricao_indicio = dados_identificacao.get("descricao_indicio", None)
+    descricao_indicio = identificacao.descricao
 
     col_header4, col_copy4 = st.columns([9, 1])
     with col_header4:
@@ -1344,11 +2135,8 @@ if extrato_file and defesa_file:
             st.code(descricao_indicio, language=None)
 
     if descricao_indicio:
-        st.markdown(f"""
-        <div style="background: #ffffff; padding: 1.25rem; border-radius: 10px; color: #1f2937; font-weight: 400; line-height: 1.7; border: 1px solid #e5e7eb; box-shadow: 0 2px 10px rgba(0,0,0,0.05); font-size: 0.95rem;">
-        {descricao_indicio}
-        </div>
-        """, unsafe_allow_html=True)
+        with st.container(border=True):
+            st.markdown(texto_markdown(descricao_indicio))
     else:
         st.warning("⚠️ Descrição do indício não foi identificada no extrato.")
 
@@ -1357,25 +2145,35 @@ if extrato_file and defesa_file:
     # 5. Achado TCU (classificação baseada APENAS no extrato)
     st.markdown("### 5️⃣ Achado TCU")
 
-    with st.spinner("🔎 Classificando achado do TCU..."):
+    with st.spinner("🔎 Classificando achado do TCU e extraindo alegações do recurso..."):
         # Usar a descrição do indício extraída, não o texto completo do extrato
-        descricao_para_analise = descricao_indicio if descricao_indicio else texto_extrato
-        saida_gpt = classificar_com_gpt(descricao_para_analise, texto_defesa)
-
-    try:
-        saida_limpa = saida_gpt.strip()
-        if saida_limpa.startswith("```"):
-            saida_limpa = saida_limpa.strip("`")
-            saida_limpa = saida_limpa.replace("json", "", 1).strip()
-        parsed = json.loads(saida_limpa)
-    except Exception:
-        st.error(f"⚠️ Erro ao ler resposta do GPT. Retorno bruto:\n{saida_gpt}")
+        # (sem ela, só os trechos do extrato em torno dos termos do indício)
+        descricao_para_analise = descricao_indicio if descricao_indicio else recortar_trechos_indicio(texto_extrato)
+        # Uma única chamada devolve a classificação e as alegações (a defesa é enviada uma só vez)
+        try:
+            saida_gpt = classificar_com_escalonamento(descricao_para_analise, texto_defesa)
+        except RespostaTruncadaError:
+            st.error("⚠️ A resposta do GPT veio incompleta (limite de tokens) e não foi guardada em cache.")
+            # O clique só provoca um novo rerun, que repete a consulta à API
+            st.button("🔄 Tentar novamente", key="btn_repetir_classificacao")
+            st.stop()
+
+    parsed = ler_json_gpt(saida_gpt)
+    if parsed is None:
+        st.error(f"⚠️ Erro ao ler resposta do GPT. Retorno bruto:\n{(saida_gpt or '')[:500]}")
         st.stop()
 
     achado = parsed.get("achado", "Achado não classificado")
     argumentos = parsed.get("argumentos", [])
     outros = parsed.get("outros", [])
 
+    # Alegações no formato "1ª alegação - ..." (usado na tela e no ofício)
+    lista_alegacoes = parsed.get("alegacoes", [])
+    if lista_alegacoes:
+        alegacoes_recurso = "\n".join(f"{i}ª alegação - {alegacao}" for i, alegacao in enumerate(lista_alegacoes, start=1))
+    else:
+        alegacoes_recurso = "Não foi possível identificar alegações específicas no texto fornecido"
+
     # 🔹 REGRA DE INFERÊNCIA EMPÍRICA DECIPEX — Reclassificação de achado por pluralidade de filhos
     # Regra inferida a partir de comportamento empírico das defesas:
     # O TCU frequentemente identifica apenas um filho, mas a defesa pode revelar a existência de outros
@@ -1607,14 +2405,8 @@ if extrato_file and defesa_file:
     # 6. Recurso apresentado (alegações da pensionista)
     st.markdown("### 6️⃣ Recurso apresentado")
 
-    with st.spinner("📝 Extraindo alegações do recurso..."):
-        alegacoes_recurso = extrair_alegacoes_recurso(texto_defesa)
-
-    st.markdown(f"""
-    <div style="background: #ffffff; padding: 1.25rem; border-radius: 10px; color: #1f2937; font-weight: 400; line-height: 1.7; white-space: pre-wrap; border: 1px solid #e5e7eb; box-shadow: 0 2px 10px rgba(0,0,0,0.05); font-size: 0.95rem;">
-    {alegacoes_recurso}
-    </div>
-    """, unsafe_allow_html=True)
+    with st.container(border=True):
+        st.markdown(texto_markdown(alegacoes_recurso))
 
     st.markdown("<br>", unsafe_allow_html=True)
 
@@ -1644,18 +2436,26 @@ if extrato_file and defesa_file:
         if st.button("📋", key="copy_defesa_previa", help="Copiar texto da defesa prévia"):
             st.code(texto_defesa_previa, language=None)
 
-    st.markdown(f"""
-    <div style="background: #ffffff; padding: 1.25rem; border-radius: 10px; color: #1f2937; font-weight: 400; line-height: 1.7; border: 1px solid #e5e7eb; box-shadow: 0 2px 10px rgba(0,0,0,0.05); font-size: 0.95rem;">
-    {texto_defesa_previa}
-    </div>
-    """, unsafe_allow_html=True)
+    with st.container(border=True):
+        st.markdown(texto_defesa_previa)
 
     st.markdown("<br>", unsafe_allow_html=True)
 
     # 8. Decisão
     st.markdown("### 8️⃣ Decisão")
 
-    s1, s2, args_improc, args_proc = analisar_com_matriz(achado, argumentos)
+    # Reaproveita a decisão enquanto as entradas não mudam (reruns de outros widgets).
+    # A chave inclui tudo o que analisar_com_matriz lê: achado, argumentos e os flags do session_state
+    chave_matriz = (
+        achado,
+        tuple(argumentos),
+        st.session_state.get("tem_filho_defesa", False),
+        st.session_state.get("nup_detectado"),
+    )
+    if st.session_state.get("chave_matriz") != chave_matriz:
+        st.session_state.resultado_matriz = analisar_com_matriz(achado, argumentos)
+        st.session_state.chave_matriz = chave_matriz
+    s1, s2, args_improc, args_proc = st.session_state.resultado_matriz
 
     if s1 == "procedente":
         st.markdown(f"""
@@ -1688,13 +2488,8 @@ if extrato_file and defesa_file:
         st.warning(f"⚠️ **Argumentos não mapeados:** {', '.join(outros)}")
 
         # Sugestão automática de resposta
-        sugestao = []
-        if any("boa-fé" in o.lower() or "segurança jurídica" in o.lower() for o in outros):
-            sugestao.append(
-                "A invocação de boa-fé e segurança jurídica não descaracteriza o achado. "
-                "O TCU entende que a manutenção do benefício depende da ausência de união estável, "
-                "independentemente da confiança legítima ou da boa-fé alegada."
-            )
+        texto_outros = "\x1f".join(outros)
+        sugestao = [texto for padrao, texto in SUGESTOES_RESPOSTA if padrao.search(texto_outros)]
         if sugestao:
             st.info("💡 **Sugestão de resposta:**")
             for s in sugestao:
@@ -1712,29 +2507,31 @@ if extrato_file and defesa_file:
     with col_btn_gerar:
         if st.button("🚀 Gerar Corpo do Ofício", type="primary", key="gerar_oficio", use_container_width=True):
             # Usar session_state para armazenar o ofício gerado
-            with st.spinner("Gerando ofício..."):
+            # Prévia temporária: mostra o texto à medida que chega e é removida ao final (o ofício fica na barra lateral)
+            previa_oficio = st.empty()
+            with previa_oficio.container(border=True):
                 # Filtrar argumentos conforme decisão
                 # Se procedente, usar apenas args procedentes; se improcedente, usar apenas args improcedentes
                 args_filtrados = args_proc if s1 == "procedente" else args_improc
 
-                # Gerar ofício com análise dos argumentos FILTRADOS
-                st.session_state.corpo_oficio = gerar_corpo_oficio(
+                # Gerar ofício com análise dos argumentos FILTRADOS, exibindo o texto à medida que chega
+                st.session_state.corpo_oficio = st.write_stream(gerar_corpo_oficio(
                     decisao=s1,
                     achado=achado,
                     argumentos=args_filtrados,
                     outros=outros,
                     alegacoes=alegacoes_recurso,
                     texto_defesa_previa=texto_defesa_previa,
-                    dados_identificacao=dados_identificacao,
-                    descricao_indicio=descricao_indicio
-                )
+                    identificacao=identificacao
+                ))
                 st.session_state.dados_oficio = {
-                    'nome': nome,
-                    'cpf': cpf,
-                    'codigo': codigo,
+                    'nome': identificacao.nome,
+                    'cpf': identificacao.cpf,
+                    'codigo': identificacao.codigo,
                     'decisao': s1
                 }
 
+            previa_oficio.empty()
             st.success("✅ Ofício gerado com sucesso! Veja na barra lateral →")
 
     # Botão de download (sempre visível se já foi gerado)
@@ -1750,16 +2547,6 @@ if extrato_file and defesa_file:
                 use_container_width=True
             )
 
-# CSS para aumentar a largura da sidebar
-st.markdown("""
-<style>
-[data-testid="stSidebar"] {
-    min-width: 50% !important;
-    max-width: 50% !important;
-}
-</style>
-""", unsafe_allow_html=True)
-
 # SIDEBAR - Mostrar o ofício gerado (estilo artefato do Claude)
 if 'corpo_oficio' in st.session_state:
     with st.sidebar:
@@ -1795,162 +2582,12 @@ if 'corpo_oficio' in st.session_state:
         st.markdown("---")
 
         # Corpo do ofício com formatação melhorada - FUNDO BRANCO
-        st.markdown(f"""
-        <div style="
-            background-color: #ffffff;
-            color: #000000;
-            line-height: 1.8;
-            font-size: 14px;
-            text-align: justify;
-            padding: 20px;
-            border-radius: 8px;
-            border: 1px solid #00d9ff;
-        ">
-        {st.session_state.corpo_oficio.replace(chr(10), '<br><br>')}
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(CORPO_OFICIO_HTML.format(corpo=st.session_state.corpo_oficio.replace(chr(10), '<br><br>')), unsafe_allow_html=True)
 
         st.markdown("---")
 
-        # Sistema de Feedback
-        st.markdown("### 💬 Avaliação da Análise")
-        st.caption("Sua avaliação ajuda a melhorar o sistema")
-
-        # CSS customizado para os botões de feedback
-        st.markdown("""
-        <style>
-        /* Botão verde para análise correta */
-        div[data-testid="stHorizontalBlock"] button[kind="primary"]:has(p:contains("✅")) {
-            background-color: #28a745 !important;
-            border-color: #28a745 !important;
-        }
-        div[data-testid="stHorizontalBlock"] button[kind="primary"]:has(p:contains("✅")):hover {
-            background-color: #218838 !important;
-            border-color: #1e7e34 !important;
-        }
-
-        /* Botão vermelho para análise incorreta */
-        div[data-testid="stHorizontalBlock"] button[kind="secondary"]:has(p:contains("❌")) {
-            background-color: #dc3545 !important;
-            border-color: #dc3545 !important;
-            color: white !important;
-        }
-        div[data-testid="stHorizontalBlock"] button[kind="secondary"]:has(p:contains("❌")):hover {
-            background-color: #c82333 !important;
-            border-color: #bd2130 !important;
-        }
-        </style>
-        """, unsafe_allow_html=True)
-
-        col_feedback1, col_feedback2 = st.columns(2)
-
-        with col_feedback1:
-            if st.button("✅ Análise Correta", key="feedback_correto", use_container_width=True, type="primary"):
-                # Ativar modo de sugestão opcional
-                st.session_state.mostrar_sugestao = True
-
-        with col_feedback2:
-            if st.button("❌ Análise Incorreta", key="feedback_incorreto", use_container_width=True):
-                # Abrir campo para comentário obrigatório
-                st.session_state.mostrar_comentario = True
-
-        # Campo de sugestão (OPCIONAL - análise correta)
-        if st.session_state.get('mostrar_sugestao', False):
-            st.success("✅ **Análise marcada como CORRETA**")
-
-            sugestao = st.text_area(
-                "💡 Deseja sugerir melhorias? (opcional)",
-                placeholder="Se tiver alguma sugestão de melhoria, compartilhe conosco...",
-                key="sugestao_feedback",
-                height=80
-            )
-
-            col_env1, col_env2 = st.columns(2)
-            with col_env1:
-                if st.button("Enviar Feedback", key="enviar_sugestao", type="primary", use_container_width=True):
-                    # Salvar feedback positivo com sugestão opcional
-                    with st.spinner("Salvando feedback no B2..."):
-                        feedback = {
-                            'timestamp': pd.Timestamp.now(),
-                            'codigo': dados['codigo'],
-                            'nome': dados['nome'],
-                            'decisao': dados['decisao'],
-                            'achado': st.session_state.get('achado_atual', 'N/A'),
-                            'avaliacao': 'correto',
-                            'comentario': sugestao if sugestao else '',
-                            'corpo_oficio': st.session_state.corpo_oficio
-                        }
-
-                        # Baixar feedbacks existentes do B2
-                        df_existente = download_feedbacks_from_b2()
-
-                        # Adicionar novo feedback
-                        df_novo = pd.DataFrame([feedback])
-                        df_atualizado = pd.concat([df_existente, df_novo], ignore_index=True)
-
-                        # Fazer upload para B2
-                        if upload_feedbacks_to_b2(df_atualizado):
-                            st.success("✅ Obrigado! Feedback registrado com sucesso.")
-                            st.session_state.mostrar_sugestao = False
-                            st.rerun()
-                        else:
-                            st.error("❌ Erro ao salvar feedback no B2.")
-
-            with col_env2:
-                if st.button("Cancelar", key="cancelar_sugestao", use_container_width=True):
-                    st.session_state.mostrar_sugestao = False
-                    st.rerun()
-
-        # Campo de comentário (OBRIGATÓRIO - análise incorreta)
-        if st.session_state.get('mostrar_comentario', False):
-            st.error("❌ **Análise marcada como INCORRETA**")
-
-            comentario = st.text_area(
-                "⚠️ O que estava incorreto? (obrigatório)",
-                placeholder="Descreva o problema encontrado na análise. Este campo é OBRIGATÓRIO.",
-                key="comentario_feedback",
-                height=100
-            )
-
-            col_env1, col_env2 = st.columns(2)
-            with col_env1:
-                if st.button("Enviar Feedback", key="enviar_comentario", type="primary", use_container_width=True):
-                    # Validar se comentário foi preenchido
-                    if not comentario or comentario.strip() == "":
-                        st.error("⚠️ Por favor, descreva o que estava incorreto. Este campo é obrigatório.")
-                    else:
-                        # Salvar feedback negativo com comentário
-                        with st.spinner("Salvando feedback no B2..."):
-                            feedback = {
-                                'timestamp': pd.Timestamp.now(),
-                                'codigo': dados['codigo'],
-                                'nome': dados['nome'],
-                                'decisao': dados['decisao'],
-                                'achado': st.session_state.get('achado_atual', 'N/A'),
-                                'avaliacao': 'incorreto',
-                                'comentario': comentario,
-                                'corpo_oficio': st.session_state.corpo_oficio
-                            }
-
-                            # Baixar feedbacks existentes do B2
-                            df_existente = download_feedbacks_from_b2()
-
-                            # Adicionar novo feedback
-                            df_novo = pd.DataFrame([feedback])
-                            df_atualizado = pd.concat([df_existente, df_novo], ignore_index=True)
-
-                            # Fazer upload para B2
-                            if upload_feedbacks_to_b2(df_atualizado):
-                                st.success("✅ Obrigado pelo feedback! Isso nos ajudará a melhorar.")
-                                st.session_state.mostrar_comentario = False
-                                st.rerun()
-                            else:
-                                st.error("❌ Erro ao salvar feedback no B2.")
-
-            with col_env2:
-                if st.button("Cancelar", key="cancelar_comentario", use_container_width=True):
-                    st.session_state.mostrar_comentario = False
-                    st.rerun()
+        # Sistema de Feedback (fragmento: interagir com ele não reexecuta a análise)
+        bloco_feedback(dados)
 
 # ==============================
 # 🔹 Rodapé Institucional DECIPEX